@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+import aiohttp
+from colorama import Fore
+from metrics import console, record_fetch
+from scraper_classes import DEFAULT_HEADERS_BING, FetchResponse
+
+try:
+    from aiohttp_socks import ProxyConnector
+except ImportError:
+    ProxyConnector = None
+
+class AsyncFetcher:
+    # asyncio counterpart of RequestsFetcher / TorIPChanger: same get() contract,
+    # but get() and change_tor_identity() are coroutines.
+    def __init__(self, max_connections=100, proxy_url=None, identity_changer=None, custom_headers=None):
+        self.max_connections = max_connections
+        self.proxy_url = proxy_url
+        # Optional TorIPChanger used (in a thread) to request a new Tor identity.
+        self.identity_changer = identity_changer
+        self.headers = DEFAULT_HEADERS_BING.copy()
+        if custom_headers:
+            self.headers.update(custom_headers)
+        self.is_tor_fetcher = identity_changer is not None
+        self.last_response_content = None
+        self._session = None
+
+    def _build_connector(self):
+        if self.proxy_url:
+            if ProxyConnector is None:
+                raise ImportError("The 'aiohttp_socks' library is required for proxied async fetching: pip install aiohttp_socks")
+            return ProxyConnector.from_url(self.proxy_url, rdns=True, limit=self.max_connections)
+        return aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self._build_connector(),
+                headers=self.headers
+            )
+        return self._session
+
+    async def change_tor_identity(self):
+        if self.identity_changer is None:
+            return True
+        return await asyncio.to_thread(self.identity_changer.change_tor_identity)
+
+    def request_new_identity(self):
+        if self.identity_changer is not None:
+            self.identity_changer.request_new_identity()
+
+    async def get(self, url, timeout=20, custom_headers_for_request=None):
+        session = await self._get_session()
+        started = time.perf_counter()
+        result = None
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout),
+                                   headers=custom_headers_for_request) as response:
+                text = await response.text(errors="replace")
+                self.last_response_content = text
+                result = FetchResponse(response.status, text, url=str(response.url), headers=dict(response.headers))
+                return result
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+        except Exception as e:
+            console(Fore.RED + f"Unexpected async fetch error for {url}: {e}", "fetch_error", logging.ERROR,
+                    url=url, error=str(e))
+            return None
+        finally:
+            record_fetch("async", started, result)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
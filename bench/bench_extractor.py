@@ -0,0 +1,142 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import urllib.parse
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extractor import CardExtractor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASE_URL = "https://www.bing.com"
+
+# Reference implementation: the per-selector extraction BingShopScraper used
+# before extractor.py. Kept here to check the new engines produce the same output.
+def legacy_extract(html, base_url=BASE_URL):
+    products_on_page = []
+    soup = BeautifulSoup(html, "lxml")
+    product_card_selectors = [
+        "li.GridItem", "div.br-resultsItemObsRV", "div.sh-dlr__list-result",
+        "div.sh-dgr__grprod", "div.br-card", "div.Card", "div.algocore",
+        "div.product-item", "div[data-hveid]", "div[data-listing-id]"
+    ]
+    product_cards = []
+    for selector in product_card_selectors:
+        found_cards = soup.select(selector)
+        if found_cards:
+            product_cards.extend(found_cards)
+    unique_product_cards = list(dict.fromkeys(product_cards))
+
+    for card in unique_product_cards:
+        product_data = {"title": "N/A", "price": "N/A", "link": "N/A", "store": "N/A"}
+
+        title_container = card.find('div', class_=lambda c: c and 'br-title' in c.split() and 'br-freeGridFontChange' in c.split())
+        if title_container:
+            title_span = title_container.find('span', title=True)
+            if title_span:
+                product_data["title"] = title_span.get_text(strip=True)
+            else:
+                product_data["title"] = title_container.get_text(strip=True)
+
+        price_outer_container = card.find('div', class_=lambda c: c and 'pd-price' in c.split())
+        if price_outer_container:
+            price_inner_div = price_outer_container.find('div', class_='resp-one-line')
+            if price_inner_div:
+                product_data["price"] = price_inner_div.get_text(strip=True)
+            else:
+                product_data["price"] = price_outer_container.get_text(strip=True)
+
+        link_tag = None
+        if card.name == 'a' and card.has_attr('href'):
+            link_tag = card
+        else:
+            if title_container and title_container.find_parent('a', href=True):
+                link_tag = title_container.find_parent('a', href=True)
+            elif card.find('h3') and card.find('h3').find_parent('a', href=True):
+                link_tag = card.find('h3').find_parent('a', href=True)
+            if not link_tag:
+                link_tag = card.find('a', href=True)
+        if link_tag and link_tag.has_attr('href'):
+            product_data["link"] = link_tag['href']
+
+        store_seller_name_div = card.find('div', class_=lambda c: c and 'br-sellerName' in c.split())
+        if store_seller_name_div:
+            actual_seller_div = store_seller_name_div.find('div', class_='br-seller')
+            if actual_seller_div:
+                product_data["store"] = actual_seller_div.get_text(strip=True)
+        if product_data["store"] == "N/A":
+            store_tag_merchant = card.find(['a', 'div', 'span'], class_=['br-merchantName', re.compile(r'merchant', re.I)])
+            if store_tag_merchant:
+                product_data["store"] = store_tag_merchant.get_text(strip=True)
+        if product_data["store"] == "N/A":
+            store_from_tag = card.find('div', class_='br-pdFrom')
+            if store_from_tag:
+                store_span = store_from_tag.find('span')
+                text_to_use = store_span.get_text(strip=True) if store_span else store_from_tag.get_text(strip=True)
+                if text_to_use.lower().startswith("from "):
+                    product_data["store"] = text_to_use[5:].strip()
+                else:
+                    product_data["store"] = text_to_use
+
+        if product_data["link"] and not product_data["link"].startswith(('http://', 'https://')):
+            product_data["link"] = urllib.parse.urljoin(base_url, product_data["link"].strip())
+
+        if (product_data["title"] != "N/A" and product_data["title"].strip()) or \
+           (product_data["link"] != "N/A" and product_data["link"].strip()):
+            products_on_page.append(product_data)
+    return products_on_page
+
+def load_fixtures(pattern="*.html"):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, pattern))):
+        with open(path, "r", encoding="utf-8") as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+def time_pages(extract, pages, iterations):
+    documents = list(pages.values())
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for html in documents:
+            extract(html)
+    elapsed = time.perf_counter() - start
+    return (iterations * len(documents)) / elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark product card extraction on saved HTML fixtures.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--pattern", default="*.html")
+    args = parser.parse_args(argv)
+
+    pages = load_fixtures(args.pattern)
+    if not pages:
+        print(f"No fixtures matching {args.pattern} in {FIXTURES_DIR}")
+        return 1
+
+    engines = {
+        "legacy": legacy_extract,
+        "bs4": lambda html, e=CardExtractor("bs4"): e.extract(html, BASE_URL)[0],
+        "lxml": lambda html, e=CardExtractor("lxml"): e.extract(html, BASE_URL)[0],
+    }
+
+    mismatches = 0
+    for name, html in pages.items():
+        expected = legacy_extract(html)
+        for engine_name in ("bs4", "lxml"):
+            if engines[engine_name](html) != expected:
+                mismatches += 1
+                print(f"MISMATCH: {engine_name} engine differs from legacy on {name}")
+    print(f"{len(pages)} fixtures, output check: {'OK' if not mismatches else f'{mismatches} mismatches'}")
+
+    baseline = None
+    for engine_name, extract in engines.items():
+        pages_per_sec = time_pages(extract, pages, args.iterations)
+        baseline = baseline or pages_per_sec
+        print(f"{engine_name:>8}: {pages_per_sec:8.1f} pages/sec ({pages_per_sec / baseline:.2f}x legacy)")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scraper_classes
+from scraper_classes import BingShopScraper, RequestsFetcher
+from extractor import CardExtractor
+from sinks import NullSink
+from bench.mock_bing import MockBingServer, add_fault_arguments, fault_options
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCHMARKS = ("page", "scrape", "main")
+
+def serve_mock(port, options):
+    server = MockBingServer("127.0.0.1", port, **options)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def start_mock_server(options):
+    # The mock runs in its own process so CPU time and RSS below are the scraper's alone.
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = multiprocessing.Process(target=serve_mock, args=(port, options), daemon=True)
+    process.start()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url + "/__stats", timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Mock Bing server did not start")
+
+def server_stats(url):
+    return requests.get(url + "/__stats", timeout=5).json()
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def timed(fn, latencies):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def measure(name, server_url, run, verbose=False):
+    # run(latencies) does the work and appends one latency per operation.
+    latencies = []
+    before = server_stats(server_url)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        run(latencies)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    after = server_stats(server_url)
+    pages = after["requests"] - before["requests"]
+    return {
+        "benchmark": name,
+        "operations": len(latencies),
+        "pages": pages,
+        "served": {key: after[key] - before[key] for key in after},
+        "wall_sec": round(wall, 3),
+        "pages_per_sec": round(pages / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "cpu_ms_per_page": round(cpu * 1000 / pages, 3) if pages else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+    }
+
+@contextlib.contextmanager
+def fetcher_factory(args):
+    # Yields a function returning the fetcher for one term, like main.process_search_term.
+    if args.backend == "httpx":
+        from http_client import SharedHttpFetcher
+        shared = SharedHttpFetcher(max_connections=args.workers * args.page_concurrency)
+        try:
+            yield lambda: shared
+        finally:
+            shared.close()
+    else:
+        yield RequestsFetcher
+
+def bench_page(terms, args):
+    # extract_product_info_from_page on its own: one fetch + parse per term, no retries.
+    extractor = CardExtractor(args.engine)
+    def run(latencies):
+        with fetcher_factory(args) as make_fetcher:
+            fetch_page = timed(lambda term: BingShopScraper(
+                term, fetcher_instance=make_fetcher(), extractor=extractor, output_sink=NullSink()
+            ).extract_product_info_from_page(), latencies)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(fetch_page, terms))
+    return run
+
+def bench_scrape(terms, args):
+    extractor = CardExtractor(args.engine)
+    def run(latencies):
+        with fetcher_factory(args) as make_fetcher:
+            scrape_term = timed(lambda term: BingShopScraper(
+                term,
+                fetcher_instance=make_fetcher(),
+                page_retry_attempts=args.retries,
+                extractor=extractor,
+                output_sink=NullSink(),
+                max_pages=args.pages,
+                page_concurrency=args.page_concurrency
+            ).scrape(), latencies)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(scrape_term, terms))
+    return run
+
+def bench_main(terms, args):
+    # The real driver, configured through main's module constants like a user would.
+    import main as scraper_main
+    def run(latencies):
+        work_dir = tempfile.mkdtemp(prefix="bench_main_")
+        terms_file = os.path.join(work_dir, "terms.txt")
+        with open(terms_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(terms) + "\n")
+        settings = {
+            "CATEGORY_PATHS_FILE": terms_file,
+            "USE_TOR": False,
+            "HTTP_BACKEND": args.backend,
+            "HTTP_MAX_CONNECTIONS": args.workers * args.page_concurrency,
+            "MAX_CONCURRENT_WORKERS": args.workers,
+            "BATCH_SIZE": args.batch_size,
+            "BATCH_PAUSE_SECONDS": 0,
+            "PAGE_RETRY_ATTEMPTS": args.retries,
+            "MAX_PAGES_PER_CATEGORY": args.pages,
+            "PAGE_FETCH_CONCURRENCY": args.page_concurrency,
+            "EXTRACTOR": CardExtractor(args.engine),
+            "OUTPUT_DIR": os.path.join(work_dir, "out"),
+            "JOB_STORE_PATH": os.path.join(work_dir, "jobs.sqlite"),
+            "USE_RESPONSE_CACHE": False,
+            "USE_ADAPTIVE_THROTTLE": args.throttle,
+            "MAX_CONCURRENCY": args.workers,
+            "process_search_term": timed(scraper_main.process_search_term, latencies),
+        }
+        saved = {name: getattr(scraper_main, name) for name in settings}
+        try:
+            for name, value in settings.items():
+                setattr(scraper_main, name, value)
+            scraper_main.main()
+        finally:
+            for name, value in saved.items():
+                setattr(scraper_main, name, value)
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return run
+
+def print_result(result):
+    rss = f"{result['peak_rss_mb']:.1f} MB" if result["peak_rss_mb"] is not None else "n/a"
+    print(f"{result['benchmark']:>7}: {result['pages_per_sec']:8.1f} pages/sec | "
+          f"p50 {result['p50_ms']:8.1f} ms | p99 {result['p99_ms']:8.1f} ms | "
+          f"CPU {result['cpu_ms_per_page']:7.2f} ms/page | peak RSS {rss} | "
+          f"{result['pages']} pages, {result['operations']} ops in {result['wall_sec']} s")
+    faults = {key: value for key, value in result["served"].items() if key not in ("requests", "ok", "bytes") and value}
+    if faults:
+        print(f"         served faults: {faults}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scraper end to end against a local mock Bing shop.")
+    parser.add_argument("benchmarks", nargs="*", metavar="{page,scrape,main}",
+                        help="Which benchmarks to run (default: all). Peak RSS is per process, so run one at a time to compare it.")
+    parser.add_argument("--terms", type=int, default=60, help="Number of search terms")
+    parser.add_argument("--workers", type=int, default=3, help="Concurrent terms (MAX_CONCURRENT_WORKERS)")
+    parser.add_argument("--batch-size", type=int, default=5, help="BATCH_SIZE for the main() benchmark")
+    parser.add_argument("--pages", type=int, default=3, help="Result pages per term")
+    parser.add_argument("--page-concurrency", type=int, default=3)
+    parser.add_argument("--retries", type=int, default=3, help="page_retry_attempts")
+    parser.add_argument("--engine", choices=("bs4", "lxml"), default="lxml")
+    parser.add_argument("--backend", choices=("requests", "httpx"), default="httpx",
+                        help="requests: a session per term; httpx: one shared pooled client")
+    parser.add_argument("--throttle", action="store_true", help="Keep the adaptive throttle on in the main() benchmark")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the scraper's own output")
+    add_fault_arguments(parser)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    process, server_url = start_mock_server(fault_options(args))
+    saved_shop_url = scraper_classes.BING_SHOP_URL
+    scraper_classes.BING_SHOP_URL = server_url + "/shop"
+    terms = [f"bench term {i}" for i in range(args.terms)]
+    runners = {"page": bench_page, "scrape": bench_scrape, "main": bench_main}
+    results = []
+    try:
+        print(f"Mock Bing shop at {server_url}: {args.terms} terms, {args.workers} workers, "
+              f"{args.pages} pages/term, engine {args.engine}, backend {args.backend}")
+        for name in args.benchmarks or BENCHMARKS:
+            result = measure(name, server_url, runners[name](terms, args), verbose=args.verbose)
+            results.append(result)
+            print_result(result)
+    finally:
+        scraper_classes.BING_SHOP_URL = saved_shop_url
+        process.terminate()
+        process.join()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=4)
+        print(f"Results written to {args.json_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extractor import CardExtractor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RESULT_FIXTURE_PATTERNS = ("grid_*.html", "list_*.html")
+HREF_RE = re.compile(rb'href="([^"]*)"')
+
+class MockBingShop:
+    # Serves saved /shop?q= result pages from the fixtures directory. Each term
+    # always maps to the same fixture; later pages (first=N) reuse it with the
+    # links made unique so pagination sees new products. Faults are injected
+    # per request with the given probabilities.
+    def __init__(self, fixtures_dir=FIXTURES_DIR, latency=0.0, jitter=0.0, rate_429=0.0, captcha_rate=0.0,
+                 empty_rate=0.0, pages_per_term=3, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.captcha_rate = captcha_rate
+        self.empty_rate = empty_rate
+        self.pages_per_term = pages_per_term
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "captcha": 0, "empty": 0, "no_results": 0, "bytes": 0}
+
+        extractor = CardExtractor("lxml")
+        self.result_pages = []
+        for pattern in RESULT_FIXTURE_PATTERNS:
+            for path in sorted(glob.glob(os.path.join(fixtures_dir, pattern))):
+                with open(path, "rb") as f:
+                    page = f.read()
+                # The scraper derives Bing's page size from the distinct links on page 1; do the same.
+                products, _ = extractor.extract(page.decode("utf-8"), "https://www.bing.com")
+                self.result_pages.append((page, len({p["link"] for p in products}) or 1))
+        if not self.result_pages:
+            raise FileNotFoundError(f"No result page fixtures found in {fixtures_dir}")
+        with open(os.path.join(fixtures_dir, "captcha.html"), "rb") as f:
+            self.captcha_page = f.read()
+        with open(os.path.join(fixtures_dir, "no_results.html"), "rb") as f:
+            self.no_results_page = f.read()
+
+    def _count(self, outcome, body):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats[outcome] += 1
+            self.stats["bytes"] += len(body)
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def respond(self, query):
+        # Returns (status, body) for a /shop query string.
+        delay = self.latency + (self._roll() * self.jitter if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        roll = self._roll()
+        if roll < self.rate_429:
+            body = b"Too Many Requests"
+            self._count("429", body)
+            return 429, body
+        roll -= self.rate_429
+        if roll < self.captcha_rate:
+            self._count("captcha", self.captcha_page)
+            return 200, self.captcha_page
+        roll -= self.captcha_rate
+        if roll < self.empty_rate:
+            self._count("empty", b"")
+            return 200, b""
+
+        params = urllib.parse.parse_qs(query)
+        term = (params.get("q") or [""])[0]
+        try:
+            first = int((params.get("first") or ["1"])[0])
+        except ValueError:
+            first = 1
+        page, page_size = self.result_pages[zlib.crc32(term.encode("utf-8")) % len(self.result_pages)]
+        if first > 1:
+            if 1 + (first - 1) // page_size > self.pages_per_term:
+                self._count("no_results", self.no_results_page)
+                return 200, self.no_results_page
+            suffix = f"#page{first}".encode("ascii")
+            page = HREF_RE.sub(lambda m: b'href="' + m.group(1) + suffix + b'"', page)
+        self._count("ok", page)
+        return 200, page
+
+def make_handler(shop):
+    class MockBingHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without TCP_NODELAY, Nagle plus
+        # delayed ACKs stall every reused keep-alive connection by ~40 ms.
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body, content_type="text/html; charset=utf-8"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            if path == "/shop":
+                status, body = shop.respond(query)
+                self._send(status, body)
+            elif path == "/__stats":
+                with shop._lock:
+                    body = json.dumps(shop.stats).encode("utf-8")
+                self._send(200, body, "application/json")
+            else:
+                self._send(404, b"Not Found", "text/plain")
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockBingHandler
+
+class MockBingServer:
+    def __init__(self, host="127.0.0.1", port=0, **shop_options):
+        self.shop = MockBingShop(**shop_options)
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.shop))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def shop_url(self):
+        return self.url + "/shop"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-bing", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def add_fault_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay, up to this many seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="Fraction of requests answered with a CAPTCHA page")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Fraction of requests answered with an empty body")
+    parser.add_argument("--pages-per-term", type=int, default=3, help="Result pages before a term runs out")
+    parser.add_argument("--seed", type=int, default=None)
+
+def fault_options(args):
+    return {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rate_429": args.rate_429,
+        "captcha_rate": args.captcha_rate,
+        "empty_rate": args.empty_rate,
+        "pages_per_term": args.pages_per_term,
+        "seed": args.seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve saved Bing shop pages locally, with optional faults.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockBingServer(args.host, args.port, **fault_options(args))
+    print(f"Mock Bing shop on {server.shop_url} ({len(server.shop.result_pages)} result fixtures)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"Served: {server.shop.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+import time
+from markets import job_key
+from normalize import parse_price, product_digest
+
+CHANGE_ADDED = "added"
+CHANGE_REMOVED = "removed"
+CHANGE_PRICE = "price_changed"
+
+def product_key(product):
+    # 16-byte digest of canonical link + store (see normalize.product_identity);
+    # the state only stores this, not the link text, as key.
+    return product_digest(product)
+
+def same_price(old_price, new_price):
+    # "$1,299.00" and "$1299.00" are the same price; unparseable prices compare as text.
+    if old_price == new_price:
+        return True
+    old_value, new_value = parse_price(old_price), parse_price(new_price)
+    return old_value[0] is not None and old_value == new_value
+
+class ChangeTracker:
+    # Last-known product set per term, in SQLite (WAL). diff() compares a fresh
+    # scrape with it, returns only what changed and stores the new state in the
+    # same transaction.
+    def __init__(self, path="state.sqlite", emit_initial=True):
+        self.path = path
+        self.emit_initial = emit_initial
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            " term TEXT NOT NULL, key BLOB NOT NULL, price TEXT, title TEXT, link TEXT, store TEXT,"
+            " updated_at REAL NOT NULL, PRIMARY KEY (term, key)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+
+    def diff(self, term, products, partial=False):
+        # Returns a list of change records. An empty scrape is not a diff: it
+        # would mark every known product as removed. Nor is a partial one
+        # (retried, or a page failed): products it did not see are kept, not removed.
+        if not products:
+            return []
+        current = {}
+        for product in products:
+            current[product_key(product)] = product
+
+        now = time.time()
+        changes = []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                known = {row[0]: row[1:] for row in self._db.execute(
+                    "SELECT key, price, title, link, store FROM products WHERE term = ?", (term,))}
+                first_scrape = not known and self._db.execute(
+                    "SELECT 1 FROM terms WHERE term = ?", (term,)).fetchone() is None
+
+                upserts = []
+                for key, product in current.items():
+                    previous = known.get(key)
+                    if previous is None:
+                        if not first_scrape or self.emit_initial:
+                            changes.append({"change": CHANGE_ADDED, "product": product})
+                    elif not same_price(previous[0], product.get("price")):
+                        changes.append({"change": CHANGE_PRICE, "old_price": previous[0], "product": product})
+                    else:
+                        continue
+                    upserts.append((term, key, product.get("price"), product.get("title"),
+                                    product.get("link"), product.get("store"), now))
+
+                removed = [] if partial else [key for key in known if key not in current]
+                for key in removed:
+                    price, title, link, store = known[key]
+                    changes.append({"change": CHANGE_REMOVED,
+                                    "product": {"title": title, "price": price, "link": link, "store": store}})
+
+                self._db.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?)", upserts)
+                self._db.executemany("DELETE FROM products WHERE term = ? AND key = ?", ((term, key) for key in removed))
+                self._db.execute("INSERT OR REPLACE INTO terms (term, last_seen) VALUES (?, ?)", (term, now))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return changes
+
+    def stats(self):
+        with self._lock:
+            terms = self._db.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+            products = self._db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        return {"terms": terms, "products": products}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class ChangeSink:
+    # Output sink wrapper: turns each full result into a delta record and only
+    # passes it on when something changed.
+    def __init__(self, tracker, inner_sink):
+        self.tracker = tracker
+        self.inner_sink = inner_sink
+
+    def location_for(self, result):
+        return self.inner_sink.location_for(result)
+
+    def write(self, result):
+        # Each market keeps its own state for a term.
+        term = result["search_term_input"]
+        state_term = job_key(term, result["market"]) if result.get("market") else term
+        changes = self.tracker.diff(state_term, result.get("products"), partial=result.get("partial", False))
+        if not changes:
+            return None
+        delta = {
+            "search_term_input": term,
+            "timestamp": result["timestamp"],
+            "product_count": result["product_count"],
+            "change_count": len(changes),
+            "changes": changes,
+        }
+        if result.get("market"):
+            delta["market"] = result["market"]
+        return self.inner_sink.write(delta)
+
+    def after_flush(self, callback):
+        self.inner_sink.after_flush(callback)
+
+    def close(self):
+        self.inner_sink.close()
+        self.tracker.close()
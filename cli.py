@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import sys
+
+# Command-line entry point. Every scrape setting is one of main.py's module
+# constants; flags and config files only set those before main.main() runs.
+# Heavy modules (main, requests, stem, lxml, bench) are imported inside the
+# subcommand that needs them, so --help and tor-check start fast.
+
+# (flags, main.py constant, argparse options)
+SCRAPE_OPTIONS = [
+    (("--terms",), "CATEGORY_PATHS_FILE", {"metavar": "FILE", "help": "Search terms file, one per line"}),
+    (("--workers",), "MAX_CONCURRENT_WORKERS", {"type": int}),
+    (("--work-queue",), "WORK_QUEUE_SIZE", {"type": int, "metavar": "TERMS", "help": "Terms queued ahead of the workers"}),
+    (("--batch-size",), "BATCH_SIZE", {"type": int}),
+    (("--batch-pause",), "BATCH_PAUSE_SECONDS", {"type": float, "metavar": "SECONDS"}),
+    (("--pages",), "MAX_PAGES_PER_CATEGORY", {"type": int, "help": "Result pages per term"}),
+    (("--page-concurrency",), "PAGE_FETCH_CONCURRENCY", {"type": int}),
+    (("--retries",), "PAGE_RETRY_ATTEMPTS", {"type": int}),
+    (("--requeue-retries",), "REQUEUE_RETRIES", {"action": argparse.BooleanOptionalAction,
+                                                 "help": "Back off failed terms in a retry queue instead of retrying in place"}),
+    (("--retry-base-delay",), "RETRY_BASE_DELAY", {"type": float, "metavar": "SECONDS"}),
+    (("--retry-max-delay",), "RETRY_MAX_DELAY", {"type": float, "metavar": "SECONDS"}),
+    (("--engine",), "EXTRACTION_ENGINE", {"choices": ("bs4", "lxml")}),
+    (("--markets",), "MARKETS", {"nargs": "+", "metavar": "CODE", "help": "Bing markets to scrape every term in, e.g. us gb de"}),
+    # Tor
+    (("--tor",), "USE_TOR", {"action": argparse.BooleanOptionalAction}),
+    (("--tor-pool",), "USE_TOR_POOL", {"action": argparse.BooleanOptionalAction}),
+    (("--tor-pool-size",), "TOR_POOL_SIZE", {"type": int}),
+    (("--socks-port",), "TOR_SOCKS_PORT", {"type": int}),
+    (("--socks-ports",), "TOR_SOCKS_PORTS", {"type": int, "nargs": "+", "metavar": "PORT"}),
+    (("--control-port",), "TOR_CONTROL_PORT", {"type": int}),
+    (("--tor-password",), "TOR_CONTROL_PASSWORD", {}),
+    (("--newnym-interval",), "TOR_NEWNYM_INTERVAL", {"type": float, "metavar": "SECONDS"}),
+    (("--min-circuit-health",), "TOR_MIN_CIRCUIT_HEALTH", {"type": float, "help": "Rotate pooled circuits scoring below this (0..1)"}),
+    # Direct fetching
+    (("--http-backend",), "HTTP_BACKEND", {"choices": ("httpx", "requests")}),
+    (("--http2",), "HTTP2", {"action": argparse.BooleanOptionalAction}),
+    (("--max-connections",), "HTTP_MAX_CONNECTIONS", {"type": int}),
+    (("--streaming",), "STREAMING_FETCH", {"action": argparse.BooleanOptionalAction}),
+    # Engines
+    (("--async",), "USE_ASYNC", {"action": argparse.BooleanOptionalAction}),
+    (("--async-concurrency",), "ASYNC_CONCURRENCY", {"type": int}),
+    (("--pipeline",), "USE_PARSE_PIPELINE", {"action": argparse.BooleanOptionalAction}),
+    (("--parse-workers",), "PARSE_WORKERS", {"type": int}),
+    # Output
+    (("--output-mode",), "OUTPUT_MODE", {"choices": ("ndjson", "json", "parquet")}),
+    (("--output-dir",), "OUTPUT_DIR", {"metavar": "DIR"}),
+    (("--compression",), "NDJSON_COMPRESSION", {"choices": ("gzip", "zstd"), "help": "NDJSON compression"}),
+    (("--normalize",), "NORMALIZE_PRODUCTS", {"action": argparse.BooleanOptionalAction}),
+    (("--dedup",), "DEDUP_MODE", {"choices": ("bloom", "exact", "none")}),
+    (("--change-detection",), "CHANGE_DETECTION", {"action": argparse.BooleanOptionalAction}),
+    (("--state",), "CHANGE_STATE_PATH", {"metavar": "FILE", "help": "Change detection state database"}),
+    # Cache and throttle
+    (("--cache",), "USE_RESPONSE_CACHE", {"action": argparse.BooleanOptionalAction}),
+    (("--cache-dir",), "RESPONSE_CACHE_DIR", {"metavar": "DIR"}),
+    (("--offline",), "CACHE_OFFLINE", {"action": argparse.BooleanOptionalAction, "help": "Re-parse from the cache only"}),
+    (("--throttle",), "USE_ADAPTIVE_THROTTLE", {"action": argparse.BooleanOptionalAction}),
+    (("--rate",), "RATE_LIMIT_PER_SEC", {"type": float, "help": "Starting request rate"}),
+    (("--max-rate",), "MAX_RATE_PER_SEC", {"type": float}),
+    (("--min-rate",), "MIN_RATE_PER_SEC", {"type": float, "help": "Floor for the rate after blocks (default: --rate / 8)"}),
+    (("--max-concurrency",), "MAX_CONCURRENCY", {"type": int}),
+    # Job store
+    (("--job-store",), "JOB_STORE_PATH", {"metavar": "FILE"}),
+    (("--jobs",), "USE_JOB_STORE", {"action": argparse.BooleanOptionalAction, "help": "Track per-term state for resuming"}),
+    (("--resume-jobs",), "RESUME_JOBS", {"action": argparse.BooleanOptionalAction,
+                                         "help": "Always (or never) keep the terms the last run finished; "
+                                                 "by default only an interrupted run is resumed"}),
+    (("--fresh",), "RESUME_JOBS", {"action": "store_const", "const": False,
+                                   "help": "Start over even if the last run was interrupted"}),
+    (("--max-attempts",), "JOB_MAX_ATTEMPTS", {"type": int}),
+    # Observability
+    (("--quiet",), "QUIET", {"action": argparse.BooleanOptionalAction}),
+    (("--log-level",), "LOG_LEVEL", {"choices": ("DEBUG", "INFO", "WARNING", "ERROR")}),
+    (("--metrics",), "METRICS_EXPORT", {"choices": ("prometheus", "json")}),
+    (("--metrics-port",), "METRICS_PORT", {"type": int}),
+    (("--metrics-host",), "METRICS_HOST", {"metavar": "ADDRESS", "help": "Address the Prometheus exporter listens on"}),
+]
+
+# Constants main.py derives from others at import time, recomputed unless set explicitly.
+DERIVED_SETTINGS = {
+    "HTTP_MAX_CONNECTIONS": (("MAX_CONCURRENT_WORKERS", "PAGE_FETCH_CONCURRENCY"),
+                             lambda s: s.MAX_CONCURRENT_WORKERS * s.PAGE_FETCH_CONCURRENCY),
+    "TOR_POOL_SIZE": (("MAX_CONCURRENT_WORKERS",), lambda s: s.MAX_CONCURRENT_WORKERS),
+    "WORK_QUEUE_SIZE": (("MAX_CONCURRENT_WORKERS",), lambda s: s.MAX_CONCURRENT_WORKERS),
+    "TOR_SOCKS_PORTS": (("TOR_SOCKS_PORT",), lambda s: [s.TOR_SOCKS_PORT]),
+    "MAX_CONCURRENCY": (("MAX_CONCURRENT_WORKERS",), lambda s: s.MAX_CONCURRENT_WORKERS),
+    "PARSE_QUEUE_DEPTH": (("PARSE_WORKERS",), lambda s: s.PARSE_WORKERS * 4),
+    "MIN_RATE_PER_SEC": (("RATE_LIMIT_PER_SEC",), lambda s: s.RATE_LIMIT_PER_SEC / 8),
+}
+
+# Objects main() builds at run time; not settings.
+RUNTIME_OBJECTS = frozenset(("EXTRACTOR", "HTTP_CLIENT", "TOR_POOL", "OUTPUT_SINK", "RESPONSE_CACHE", "THROTTLE",
+                             "JOB_STORE", "METRICS_EXPORTER"))
+
+def load_config(path):
+    # A flat JSON or TOML table of main.py constant names (any case, - or _).
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError: # Python < 3.11
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise SystemExit("TOML config files need Python 3.11+ or: pip install tomli")
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    if not isinstance(config, dict):
+        raise SystemExit(f"Config file {path} must contain a table of settings")
+    return {setting_name(key): value for key, value in config.items()}
+
+def setting_name(key):
+    return key.strip().replace("-", "_").upper()
+
+def parse_set_option(option):
+    # --set NAME=VALUE; the value is read as JSON when it parses, else kept as a string.
+    name, separator, value = option.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {option!r}")
+    try:
+        return setting_name(name), json.loads(value)
+    except json.JSONDecodeError:
+        return setting_name(name), value
+
+def collect_settings(args):
+    # Precedence: main.py defaults < --config file < flags < --set.
+    settings = {}
+    if args.config:
+        settings.update(load_config(args.config))
+    for _, name, _ in SCRAPE_OPTIONS:
+        if name in vars(args):
+            settings[name] = getattr(args, name)
+    settings.update(args.set or [])
+    if settings.get("DEDUP_MODE") == "none":
+        settings["DEDUP_MODE"] = None
+    return settings
+
+def apply_settings(scraper, settings):
+    unknown = sorted(name for name in settings
+                     if not name.isupper() or not hasattr(scraper, name) or name in RUNTIME_OBJECTS)
+    if unknown:
+        raise SystemExit(f"Unknown setting(s): {', '.join(unknown)}")
+    for name, value in settings.items():
+        setattr(scraper, name, value)
+    for name, (sources, derive) in DERIVED_SETTINGS.items():
+        if name not in settings and any(source in settings for source in sources):
+            setattr(scraper, name, derive(scraper))
+    if "EXTRACTION_ENGINE" in settings:
+        scraper.EXTRACTOR = scraper.CardExtractor(scraper.EXTRACTION_ENGINE)
+
+def add_scrape_options(parser):
+    parser.add_argument("--config", metavar="FILE", help="JSON or TOML file of settings (main.py constant names)")
+    parser.add_argument("--set", action="append", type=parse_set_option, metavar="NAME=VALUE",
+                        help="Override any main.py setting; repeatable")
+    for flags, name, options in SCRAPE_OPTIONS:
+        parser.add_argument(*flags, dest=name, default=argparse.SUPPRESS, **options)
+
+def command_scrape(args, resume=False):
+    import main as scraper
+    settings = collect_settings(args)
+    if resume:
+        settings.update(USE_JOB_STORE=True, RESUME_JOBS=True, INGEST_TERMS=False)
+    apply_settings(scraper, settings)
+    if args.print_config:
+        names = sorted(name for name in vars(scraper) if name.isupper() and name not in RUNTIME_OBJECTS)
+        print(json.dumps({name: getattr(scraper, name) for name in names}, indent=4))
+        return 0
+    scraper.main()
+    return 0
+
+def command_resume(args):
+    return command_scrape(args, resume=True)
+
+def command_bench(args):
+    # "bench extractor ..." runs bench/bench_extractor.py, anything else bench/bench_scraper.py.
+    bench_args = list(args.bench_args)
+    if bench_args[:1] == ["extractor"]:
+        from bench import bench_extractor
+        return bench_extractor.main(bench_args[1:])
+    if bench_args[:1] == ["scraper"]:
+        bench_args = bench_args[1:]
+    from bench import bench_scraper
+    return bench_scraper.main(bench_args)
+
+def command_tor_check(args):
+    # Control port: authenticate and read the circuit status. SOCKS port: fetch
+    # the exit IP. --newnym also asks for a new identity and checks the IP moved.
+    from colorama import Fore, Style
+    ok = True
+    try:
+        from stem.control import Controller
+    except ImportError:
+        print(Fore.RED + "The 'stem' library is required for Tor: pip install stem")
+        return 1
+    try:
+        with Controller.from_port(port=args.control_port) as controller:
+            if args.password:
+                controller.authenticate(password=args.password)
+            else:
+                controller.authenticate()
+            established = controller.get_info("status/circuit-established", "0") == "1"
+            print(Fore.GREEN + f"Control port {args.control_port}: Tor {controller.get_version()}, "
+                  f"circuit established: {established}")
+            ok = ok and established
+    except Exception as e:
+        print(Fore.RED + f"Control port {args.control_port}: {e}")
+        ok = False
+
+    from tor import TorIPChanger
+    for socks_port in args.socks_ports:
+        changer = TorIPChanger(tor_socks_port=socks_port, tor_control_port=args.control_port,
+                               control_password=args.password, new_ip_wait_time=args.wait)
+        ip = changer.get_current_ip(log_errors=False)
+        if ip == "IP Not Found":
+            print(Fore.RED + f"SOCKS port {socks_port}: no response through Tor")
+            ok = False
+            continue
+        print(Fore.GREEN + f"SOCKS port {socks_port}: exit IP {ip}")
+        if args.newnym:
+            changed = changer.change_tor_identity()
+            print((Fore.GREEN if changed else Fore.RED) +
+                  f"SOCKS port {socks_port}: NEWNYM {'ok' if changed else 'failed'}, exit IP {changer.get_current_ip(log_errors=False)}")
+            ok = ok and changed
+    print((Fore.GREEN + Style.BRIGHT + "Tor OK") if ok else (Fore.RED + Style.BRIGHT + "Tor check failed"))
+    return 0 if ok else 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Bing Shopping scraper.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scrape = subparsers.add_parser("scrape", help="Scrape the terms file, resuming the last run if it was interrupted")
+    add_scrape_options(scrape)
+    scrape.add_argument("--print-config", action="store_true", help="Print the effective settings and exit")
+    scrape.set_defaults(handler=command_scrape)
+
+    resume = subparsers.add_parser("resume", help="Finish the pending and retryable terms in the job store only")
+    add_scrape_options(resume)
+    resume.add_argument("--print-config", action="store_true", help="Print the effective settings and exit")
+    resume.set_defaults(handler=command_resume)
+
+    bench = subparsers.add_parser("bench", help="Run the offline benchmarks (arguments are passed through)",
+                                  prefix_chars="\0")
+    bench.add_argument("bench_args", nargs=argparse.REMAINDER,
+                       help="[scraper|extractor] benchmark arguments, e.g. page scrape --backend requests")
+    bench.set_defaults(handler=command_bench)
+
+    tor_check = subparsers.add_parser("tor-check", help="Check the Tor control and SOCKS ports")
+    tor_check.add_argument("--socks-ports", type=int, nargs="+", default=[9050], metavar="PORT")
+    tor_check.add_argument("--control-port", type=int, default=9051)
+    tor_check.add_argument("--password", default=os.environ.get("TOR_CONTROL_PASSWORD"),
+                           help="Control port password (default: $TOR_CONTROL_PASSWORD)")
+    tor_check.add_argument("--newnym", action="store_true", help="Also request a new identity and check the exit IP changes")
+    tor_check.add_argument("--wait", type=int, default=15, help="Seconds to wait for a new identity")
+    tor_check.set_defaults(handler=command_tor_check)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from colorama import init
+    init(autoreset=True)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from colorama import Fore, Style, init
+from job_store import JobStore
+from sinks import build_sink
+
+init(autoreset=True)
+
+# --- Configuration ---
+COORDINATOR_HOST = "127.0.0.1" # Listening beyond localhost requires a token
+COORDINATOR_PORT = 8765
+COORDINATOR_TOKEN = os.environ.get("COORDINATOR_TOKEN") # Shared secret workers send in the X-Coordinator-Token header
+JOB_STORE_PATH = "jobs.sqlite"
+JOB_MAX_ATTEMPTS = 3
+LEASE_SECONDS = 300 # Workers must report or renew within this time, or the terms are reassigned
+MAX_LEASE_BATCH = 200
+REAPER_INTERVAL = 15
+OUTPUT_MODE = "ndjson"
+OUTPUT_DIR = "out"
+NORMALIZE_PRODUCTS = False # Normalize and dedup results here, across every worker's terms
+DEDUP_MODE = "bloom"
+
+class Coordinator:
+    # Hands out leases on batches of terms from the job store and stores the
+    # results workers send back. Expired leases are returned to pending by a
+    # reaper thread, so a crashed worker's terms go to another node.
+    def __init__(self, job_store, output_sink, lease_seconds=LEASE_SECONDS, max_lease_batch=MAX_LEASE_BATCH):
+        self.job_store = job_store
+        self.output_sink = output_sink
+        self.lease_seconds = lease_seconds
+        self.max_lease_batch = max_lease_batch
+        self._stop_event = threading.Event()
+        self._reaper_thread = None
+
+    def lease(self, worker_id, limit):
+        limit = max(1, min(int(limit), self.max_lease_batch))
+        terms = self.job_store.claim(limit, leased_by=worker_id, lease_seconds=self.lease_seconds)
+        if terms:
+            print(Fore.CYAN + f"Leased {len(terms)} terms to {worker_id}")
+        return {"terms": terms, "lease_seconds": self.lease_seconds}
+
+    def renew(self, worker_id, terms):
+        self.job_store.renew_leases(worker_id, terms, self.lease_seconds)
+        return {"renewed": len(terms), "lease_seconds": self.lease_seconds}
+
+    def submit_results(self, worker_id, results):
+        # Results for terms the worker no longer holds (its lease expired and the
+        # term was handed out again) are dropped, not written twice. The term is
+        # marked done before its record reaches disk (the sink flushes in
+        # batches), so a coordinator killed in between loses those records.
+        done = failed = stale = 0
+        for item in results:
+            term = item.get("term")
+            result = item.get("result")
+            if not term:
+                continue
+            if result and result.get("products"):
+                if not self.job_store.mark_done(term, result.get("product_count", len(result["products"])),
+                                                leased_by=worker_id):
+                    stale += 1
+                    continue
+                self.output_sink.write(result)
+                done += 1
+            elif self.job_store.mark_failed(term, item.get("error") or "no products", leased_by=worker_id):
+                failed += 1
+            else:
+                stale += 1
+        print(Fore.GREEN + f"{worker_id}: {done} terms done, {failed} failed" +
+              (Fore.YELLOW + f", {stale} stale results dropped" if stale else ""))
+        return {"done": done, "failed": failed, "stale": stale}
+
+    def status(self):
+        return self.job_store.counts()
+
+    def start_reaper(self, interval=REAPER_INTERVAL):
+        def reap():
+            while not self._stop_event.wait(interval):
+                expired = self.job_store.expire_leases()
+                if expired:
+                    print(Fore.YELLOW + f"Reassigning {expired} terms from expired leases")
+        self._reaper_thread = threading.Thread(target=reap, name="lease-reaper", daemon=True)
+        self._reaper_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._reaper_thread is not None:
+            self._reaper_thread.join()
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def make_handler(coordinator, token=None):
+    class CoordinatorHandler(BaseHTTPRequestHandler):
+        def _authorized(self):
+            if not token:
+                return True
+            sent = self.headers.get("X-Coordinator-Token") or ""
+            if hmac.compare_digest(sent.encode("utf-8"), token.encode("utf-8")):
+                return True
+            self._send_json({"error": "missing or invalid token"}, status=401)
+            return False
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path == "/status":
+                self._send_json(coordinator.status())
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            try:
+                payload = self._read_json()
+            except ValueError:
+                self._send_json({"error": "invalid JSON"}, status=400)
+                return
+            worker_id = payload.get("worker", self.client_address[0])
+            try:
+                if self.path == "/lease":
+                    self._send_json(coordinator.lease(worker_id, payload.get("limit", 10)))
+                elif self.path == "/renew":
+                    self._send_json(coordinator.renew(worker_id, payload.get("terms", [])))
+                elif self.path == "/results":
+                    self._send_json(coordinator.submit_results(worker_id, payload.get("results", [])))
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+            except Exception as e:
+                print(Fore.RED + f"Coordinator error on {self.path} from {worker_id}: {e}")
+                self._send_json({"error": str(e)}, status=500)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CoordinatorHandler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a shared term queue to scraper workers.")
+    parser.add_argument("--terms", default="category_paths.txt", help="Search terms file to ingest")
+    parser.add_argument("--host", default=COORDINATOR_HOST)
+    parser.add_argument("--port", type=int, default=COORDINATOR_PORT)
+    parser.add_argument("--token", default=COORDINATOR_TOKEN,
+                        help="Shared secret workers must send (default: $COORDINATOR_TOKEN)")
+    parser.add_argument("--job-store", default=JOB_STORE_PATH)
+    parser.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS)
+    parser.add_argument("--fresh", action="store_true", help="Start over even if the last run was interrupted")
+    parser.add_argument("--normalize", action="store_true", default=NORMALIZE_PRODUCTS,
+                        help="Parse prices, canonicalize links and drop duplicate products before writing")
+    args = parser.parse_args()
+    if not args.token and not is_loopback(args.host):
+        parser.error(f"refusing to listen on {args.host} without --token; anyone who can reach it could lease terms and submit results")
+
+    job_store = JobStore(args.job_store, max_attempts=JOB_MAX_ATTEMPTS)
+    # An interrupted run is resumed; a finished one (or --fresh) starts over.
+    if args.fresh or not job_store.unfinished():
+        job_store.reset()
+    added = job_store.ingest(args.terms)
+    requeued = job_store.recover()
+    print(Fore.BLUE + f"Job store {args.job_store}: {added} new terms, {requeued} requeued, {job_store.counts()}")
+
+    output_sink = build_sink(OUTPUT_MODE, out_dir=OUTPUT_DIR)
+    if args.normalize:
+        from normalize import NormalizingSink, ProductNormalizer, build_dedup
+        output_sink = NormalizingSink(ProductNormalizer(build_dedup(DEDUP_MODE)), output_sink)
+    coordinator = Coordinator(job_store, output_sink, lease_seconds=args.lease_seconds)
+    coordinator.start_reaper()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(coordinator, args.token))
+    print(Fore.GREEN + Style.BRIGHT + f"Coordinator listening on {args.host}:{args.port}" +
+          ("" if args.token else " (no token)"))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nShutting down coordinator...")
+    finally:
+        server.server_close()
+        coordinator.stop()
+        output_sink.close()
+        print(Fore.BLUE + f"Job store: {job_store.counts()}")
+        job_store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import glob
+import gzip
+import io
+import json
+import os
+from colorama import Fore, Style, init
+from sinks import ParquetSink, zstandard
+
+init(autoreset=True)
+
+DEFAULT_INPUTS = ("out/*.json", "out/*.ndjson", "out/*.ndjson.gz", "out/*.ndjson.zst")
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("The 'zstandard' library is required to read .zst files: pip install zstandard")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def iter_results(path):
+    # One result per .json file (the pretty-printed per-term format), one per line in NDJSON.
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield json.load(f)
+        return
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def convert(paths, out_dir, row_group_size=100_000, compression="zstd"):
+    sink = ParquetSink(out_dir=out_dir, prefix="converted", row_group_size=row_group_size, compression=compression)
+    results = 0
+    try:
+        for path in paths:
+            try:
+                for result in iter_results(path):
+                    if "search_term_input" not in result: # e.g. out/metrics.ndjson
+                        continue
+                    sink.write(result)
+                    results += 1
+            except (OSError, ValueError) as e:
+                print(Fore.RED + f"Skipping {path}: {e}")
+    finally:
+        sink.close()
+    return results, sink.rows_written
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON/NDJSON scrape results to date-partitioned Parquet.")
+    parser.add_argument("inputs", nargs="*", help=f"Files or glob patterns (default: {' '.join(DEFAULT_INPUTS)})")
+    parser.add_argument("--out-dir", default="out/parquet")
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    parser.add_argument("--compression", default="zstd", help="Parquet codec: zstd, snappy, gzip or none")
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.inputs or DEFAULT_INPUTS:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        paths.extend(path for path in matches if os.path.isfile(path))
+    if not paths:
+        print(Fore.RED + "No input files found.")
+        return 1
+
+    print(Fore.BLUE + f"Converting {len(paths)} files to {args.out_dir}/ ...")
+    results, rows = convert(paths, args.out_dir, args.row_group_size, args.compression)
+    print(Fore.GREEN + Style.BRIGHT + f"Wrote {rows} product rows from {results} results.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,305 @@
+import importlib.util
+import re
+import urllib.parse
+
+lxml = etree = None # Imported by the lxml engine on first use
+
+# Card container selectors, in priority order. A card matched by several
+# selectors is reported under the first one, exactly like running
+# soup.select() once per selector and de-duplicating with dict.fromkeys().
+PRODUCT_CARD_SELECTORS = [
+    ("li", "class", "GridItem"),
+    ("div", "class", "br-resultsItemObsRV"),
+    ("div", "class", "sh-dlr__list-result"),
+    ("div", "class", "sh-dgr__grprod"),
+    ("div", "class", "br-card"),
+    ("div", "class", "Card"),
+    ("div", "class", "algocore"),
+    ("div", "class", "product-item"),
+    ("div", "attr", "data-hveid"),
+    ("div", "attr", "data-listing-id"),
+]
+
+MERCHANT_CLASS_RE = re.compile(r'merchant', re.I)
+TEXT_SKIP_TAGS = frozenset(["script", "style", "template"])
+
+# Field rules, declared once and evaluated in a single walk over each card:
+# name -> (tag names, predicate on the set of classes / attributes).
+FIELD_RULES = {
+    "title": (("div",), lambda classes, attrs: "br-title" in classes and "br-freeGridFontChange" in classes),
+    "price": (("div",), lambda classes, attrs: "pd-price" in classes),
+    "h3": (("h3",), lambda classes, attrs: True),
+    "link": (("a",), lambda classes, attrs: "href" in attrs),
+    "seller_name": (("div",), lambda classes, attrs: "br-sellerName" in classes),
+    "merchant": (("a", "div", "span"), lambda classes, attrs: any(MERCHANT_CLASS_RE.search(c) for c in classes)),
+    "pd_from": (("div",), lambda classes, attrs: "br-pdFrom" in classes),
+}
+
+def _compile_rules(rules):
+    by_tag = {}
+    for field, (tag_names, predicate) in rules.items():
+        for tag_name in tag_names:
+            by_tag.setdefault(tag_name, []).append((field, predicate))
+    return by_tag
+
+COMPILED_FIELD_RULES = _compile_rules(FIELD_RULES)
+
+def _card_bucket(name, classes, attrs):
+    for index, (tag_name, kind, value) in enumerate(PRODUCT_CARD_SELECTORS):
+        if name != tag_name:
+            continue
+        if kind == "class" and value in classes:
+            return index
+        if kind == "attr" and value in attrs:
+            return index
+    return None
+
+def _build_product(fields, base_url):
+    product_data = {
+        "title": "N/A", "price": "N/A", "link": "N/A",
+        "store": "N/A"
+    }
+    title, price, link, store = fields
+    if title is not None:
+        product_data["title"] = title
+    if price is not None:
+        product_data["price"] = price
+    if link is not None:
+        product_data["link"] = link
+    if store is not None:
+        product_data["store"] = store
+
+    if product_data["link"] and not product_data["link"].startswith(('http://', 'https://')):
+        product_data["link"] = urllib.parse.urljoin(base_url, product_data["link"].strip())
+
+    if (product_data["title"] != "N/A" and product_data["title"].strip()) or \
+       (product_data["link"] != "N/A" and product_data["link"].strip()):
+        return product_data
+    return None
+
+def _store_from_text(text_to_use):
+    if text_to_use.lower().startswith("from "):
+        return text_to_use[5:].strip()
+    return text_to_use
+
+def _import_lxml():
+    global lxml, etree
+    if etree is None:
+        try:
+            import lxml.html
+            from lxml import etree
+        except ImportError:
+            raise ImportError("The 'lxml' library is required for the lxml extraction engine: pip install lxml") from None
+
+class CardExtractor:
+    # engine="bs4" walks the BeautifulSoup tree once per page and once per card.
+    # engine="lxml" does the same walk on a bare lxml tree, skipping the
+    # BeautifulSoup object model entirely (fast path).
+    def __init__(self, engine="bs4"):
+        if engine not in ("bs4", "lxml"):
+            raise ValueError(f"Unknown extraction engine: {engine}")
+        if engine == "lxml":
+            _import_lxml()
+        if engine == "bs4" and importlib.util.find_spec("bs4") is None:
+            raise ImportError("The 'beautifulsoup4' library is required for the bs4 extraction engine: pip install beautifulsoup4")
+        self.engine = engine
+
+    def extract(self, html, base_url):
+        # Returns (products, number_of_cards_found).
+        if self.engine == "lxml":
+            return self._extract_lxml(html, base_url)
+        return self._extract_bs4(html, base_url)
+
+    # --- BeautifulSoup engine (bs4 is imported on first use) ---
+    def _extract_bs4(self, html, base_url):
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "lxml")
+        buckets = [[] for _ in PRODUCT_CARD_SELECTORS]
+        for node in soup.find_all(True):
+            bucket = _card_bucket(node.name, node.get("class") or (), node.attrs)
+            if bucket is not None:
+                buckets[bucket].append(node)
+
+        # Tag equality/hash is structural, so this also collapses byte-identical cards.
+        cards = list(dict.fromkeys(card for bucket in buckets for card in bucket))
+        products = []
+        for card in cards:
+            product_data = _build_product(self._card_fields_bs4(card), base_url)
+            if product_data:
+                products.append(product_data)
+        return products, len(cards)
+
+    def _first_matches_bs4(self, card):
+        from bs4 import Tag
+        found = {}
+        for node in card.descendants:
+            if not isinstance(node, Tag):
+                continue
+            rules = COMPILED_FIELD_RULES.get(node.name)
+            if not rules:
+                continue
+            classes = node.get("class") or ()
+            for field, predicate in rules:
+                if field not in found and predicate(classes, node.attrs):
+                    found[field] = node
+            if len(found) == len(FIELD_RULES):
+                break
+        return found
+
+    def _card_fields_bs4(self, card):
+        found = self._first_matches_bs4(card)
+        title = price = link = store = None
+
+        title_container = found.get("title")
+        if title_container is not None:
+            title_span = title_container.find('span', title=True)
+            title = (title_span or title_container).get_text(strip=True)
+
+        price_outer_container = found.get("price")
+        if price_outer_container is not None:
+            price_inner_div = price_outer_container.find('div', class_='resp-one-line')
+            price = (price_inner_div or price_outer_container).get_text(strip=True)
+
+        link_tag = None
+        if card.name == 'a' and card.has_attr('href'):
+            link_tag = card
+        else:
+            if title_container is not None:
+                link_tag = title_container.find_parent('a', href=True)
+            if link_tag is None and found.get("h3") is not None:
+                link_tag = found["h3"].find_parent('a', href=True)
+            if link_tag is None:
+                link_tag = found.get("link")
+        if link_tag is not None:
+            link = link_tag['href']
+
+        seller_name_div = found.get("seller_name")
+        if seller_name_div is not None:
+            actual_seller_div = seller_name_div.find('div', class_='br-seller')
+            if actual_seller_div:
+                store = actual_seller_div.get_text(strip=True)
+        if store is None and found.get("merchant") is not None:
+            store = found["merchant"].get_text(strip=True)
+        if store is None and found.get("pd_from") is not None:
+            store_from_tag = found["pd_from"]
+            store_span = store_from_tag.find('span')
+            store = _store_from_text((store_span or store_from_tag).get_text(strip=True))
+
+        return title, price, link, store
+
+    # --- lxml fast path ---
+    def _extract_lxml(self, html, base_url):
+        _import_lxml() # Also in parse worker processes, which unpickle the extractor without __init__
+        if isinstance(html, str):
+            html = html.encode("utf-8")
+        try:
+            root = lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding="utf-8"))
+        except (etree.ParserError, ValueError):
+            return [], 0
+
+        buckets = [[] for _ in PRODUCT_CARD_SELECTORS]
+        for node in root.iter(etree.Element):
+            bucket = _card_bucket(node.tag, node.get("class", "").split(), node.attrib)
+            if bucket is not None:
+                buckets[bucket].append(node)
+
+        cards = []
+        seen = set()
+        for bucket in buckets:
+            for card in bucket:
+                key = etree.tostring(card, with_tail=False)
+                if key not in seen:
+                    seen.add(key)
+                    cards.append(card)
+
+        products = []
+        for card in cards:
+            product_data = _build_product(self._card_fields_lxml(card), base_url)
+            if product_data:
+                products.append(product_data)
+        return products, len(cards)
+
+    def _card_fields_lxml(self, card):
+        found = {}
+        for node in card.iterdescendants(etree.Element):
+            rules = COMPILED_FIELD_RULES.get(node.tag)
+            if not rules:
+                continue
+            classes = node.get("class", "").split()
+            for field, predicate in rules:
+                if field not in found and predicate(classes, node.attrib):
+                    found[field] = node
+            if len(found) == len(FIELD_RULES):
+                break
+
+        title = price = link = store = None
+
+        title_container = found.get("title")
+        if title_container is not None:
+            title_span = _first_lxml(title_container, "span", lambda n: n.get("title") is not None)
+            title = _text_lxml(title_span if title_span is not None else title_container)
+
+        price_outer_container = found.get("price")
+        if price_outer_container is not None:
+            price_inner_div = _first_lxml(price_outer_container, "div", lambda n: "resp-one-line" in n.get("class", "").split())
+            price = _text_lxml(price_inner_div if price_inner_div is not None else price_outer_container)
+
+        link_tag = None
+        if card.tag == 'a' and card.get('href') is not None:
+            link_tag = card
+        else:
+            if title_container is not None:
+                link_tag = _parent_link_lxml(title_container)
+            if link_tag is None and found.get("h3") is not None:
+                link_tag = _parent_link_lxml(found["h3"])
+            if link_tag is None:
+                link_tag = found.get("link")
+        if link_tag is not None:
+            link = link_tag.get('href')
+
+        seller_name_div = found.get("seller_name")
+        if seller_name_div is not None:
+            actual_seller_div = _first_lxml(seller_name_div, "div", lambda n: "br-seller" in n.get("class", "").split())
+            if actual_seller_div is not None:
+                store = _text_lxml(actual_seller_div)
+        if store is None and found.get("merchant") is not None:
+            store = _text_lxml(found["merchant"])
+        if store is None and found.get("pd_from") is not None:
+            store_from_tag = found["pd_from"]
+            store_span = _first_lxml(store_from_tag, "span", lambda n: True)
+            store = _store_from_text(_text_lxml(store_span if store_span is not None else store_from_tag))
+
+        return title, price, link, store
+
+def _first_lxml(node, tag_name, predicate):
+    for child in node.iterdescendants(tag_name):
+        if predicate(child):
+            return child
+    return None
+
+def _parent_link_lxml(node):
+    for ancestor in node.iterancestors("a"):
+        if ancestor.get("href") is not None:
+            return ancestor
+    return None
+
+def _text_lxml(node):
+    # Equivalent of BeautifulSoup's get_text(strip=True): stripped text nodes,
+    # ignoring comments and script/style contents.
+    parts = []
+    _collect_text_lxml(node, parts)
+    return "".join(parts)
+
+def _collect_text_lxml(node, parts):
+    if not isinstance(node.tag, str) or node.tag in TEXT_SKIP_TAGS:
+        return
+    if node.text:
+        text = node.text.strip()
+        if text:
+            parts.append(text)
+    for child in node:
+        _collect_text_lxml(child, parts)
+        if child.tail:
+            tail = child.tail.strip()
+            if tail:
+                parts.append(tail)
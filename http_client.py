@@ -0,0 +1,95 @@
+import importlib.util
+import threading
+import time
+from metrics import record_fetch
+from scraper_classes import DEFAULT_HEADERS_BING, FetchResponse, STREAM_CHUNK_SIZE, streamed_fetch_response
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Connection-specific headers are not allowed over HTTP/2, and the pool keeps
+# connections alive on its own.
+HOP_BY_HOP_HEADERS = ("Connection", "Keep-Alive")
+
+def http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+class SharedHttpFetcher:
+    # One httpx client shared by every worker thread, so connections (and the
+    # TCP+TLS handshakes behind them) are reused across terms. Over HTTPS the
+    # client negotiates HTTP/2 and multiplexes concurrent page fetches on one
+    # connection. httpx decodes gzip/deflate, br (with brotli installed) and
+    # zstd (with zstandard installed), so only those encodings are advertised.
+    # Same get() contract as RequestsFetcher; last_response_content is kept
+    # per thread.
+    def __init__(self, max_connections=10, http2=True, proxy_url=None, custom_headers=None, timeout=20,
+                 keepalive_expiry=30.0, streaming=True):
+        if httpx is None:
+            raise ImportError("The 'httpx' library is required for the shared HTTP client: pip install 'httpx[http2,brotli,zstd]'")
+        self.http2 = http2 and http2_available()
+        headers = {k: v for k, v in DEFAULT_HEADERS_BING.items() if k not in HOP_BY_HOP_HEADERS}
+        headers["Accept-Encoding"] = ", ".join(self.supported_encodings())
+        if custom_headers:
+            headers.update(custom_headers)
+        self.client = httpx.Client(
+            http2=self.http2,
+            headers=headers,
+            proxy=proxy_url,
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+        self.is_tor_fetcher = False
+        self.streaming = streaming
+        self._local = threading.local()
+
+    @staticmethod
+    def supported_encodings():
+        encodings = ["gzip", "deflate"]
+        if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi"):
+            encodings.append("br")
+        if importlib.util.find_spec("zstandard"):
+            encodings.append("zstd")
+        return encodings
+
+    @property
+    def last_response_content(self):
+        return getattr(self._local, "last_response_content", None)
+
+    @last_response_content.setter
+    def last_response_content(self, value):
+        self._local.last_response_content = value
+
+    def change_tor_identity(self):
+        return True
+
+    def get(self, url, timeout=None, custom_headers_for_request=None, **kwargs):
+        self.last_response_content = None
+        started = time.perf_counter()
+        result = None
+        try:
+            options = {"headers": custom_headers_for_request}
+            if timeout is not None:
+                options["timeout"] = timeout
+            if self.streaming:
+                with self.client.stream("GET", url, **options) as response:
+                    result = streamed_fetch_response(response, response.iter_bytes(STREAM_CHUNK_SIZE))
+            else:
+                response = self.client.get(url, **options)
+                result = FetchResponse(response.status_code, response.text, url=str(response.url),
+                                       headers=response.headers, content=response.content)
+            self.last_response_content = result.text
+            return result
+        except (httpx.HTTPError, httpx.StreamError):
+            return None
+        finally:
+            record_fetch("httpx", started, result)
+
+    def close(self):
+        self.client.close()
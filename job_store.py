@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import threading
+import time
+from markets import job_key
+
+STATE_PENDING = "pending"
+STATE_IN_FLIGHT = "in_flight"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+class JobStore:
+    # Durable per-term job state in SQLite (WAL mode). Terms are streamed in
+    # from the input file in chunks, and the byte offset reached is committed
+    # with each chunk, so neither ingesting nor scraping ever needs the whole
+    # term list in memory and both resume after a crash or Ctrl-C.
+    def __init__(self, path="jobs.sqlite", max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, term TEXT NOT NULL UNIQUE,"
+            " state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " product_count INTEGER, last_error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, id)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "leased_by" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN leased_by TEXT")
+            self._db.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def ingest(self, file_path, chunk_size=10000, markets=None):
+        # Adds new terms from file_path, continuing from where the last ingest stopped.
+        # With markets (a list of market codes) each term becomes one job per
+        # market, keyed by markets.job_key(). Returns the number of new jobs added.
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File {file_path} not found!")
+        source = os.path.abspath(file_path)
+        size = os.path.getsize(file_path)
+        market_list = ",".join(markets or ())
+        with self._lock:
+            offset = 0
+            # A changed market list needs jobs for terms already ingested, so start over;
+            # existing jobs are skipped by INSERT OR IGNORE.
+            if self._get_meta("source") == source and (self._get_meta("markets") or "") == market_list:
+                offset = int(self._get_meta("offset") or 0)
+                if offset > size: # File was replaced by a shorter one
+                    offset = 0
+            self._set_meta("markets", market_list)
+
+        added = 0
+        with open(file_path, "rb") as f:
+            f.seek(offset)
+            chunk = []
+            for raw_line in f:
+                term = raw_line.decode("utf-8", errors="replace").strip()
+                if term and markets:
+                    chunk.extend(job_key(term, market) for market in markets)
+                elif term:
+                    chunk.append(term)
+                # An unterminated last line may still be growing; don't move past it.
+                if raw_line.endswith(b"\n"):
+                    offset += len(raw_line)
+                if len(chunk) >= chunk_size:
+                    added += self._insert_chunk(chunk, source, offset)
+                    chunk = []
+            added += self._insert_chunk(chunk, source, offset)
+        return added
+
+    def reset(self):
+        # Starts a new run over the same store: drops every job and the ingest
+        # position, so the next ingest() reads the terms file from the top.
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM jobs")
+                self._db.execute("DELETE FROM meta WHERE key IN ('source', 'offset', 'markets')")
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _insert_chunk(self, terms, source, offset):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._db.total_changes
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO jobs (term, state, updated_at) VALUES (?, ?, ?)",
+                    ((term, STATE_PENDING, now) for term in terms)
+                )
+                added = self._db.total_changes - before
+                self._set_meta("source", source)
+                self._set_meta("offset", offset)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return added
+
+    def recover(self):
+        # Called at start-up: work left in flight by a crashed run, and failures
+        # that still have attempts left, go back to pending.
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            requeued = self._db.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?",
+                (STATE_PENDING, now, STATE_IN_FLIGHT)
+            ).rowcount
+            requeued += self._db.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ? AND attempts < ?",
+                (STATE_PENDING, now, STATE_FAILED, self.max_attempts)
+            ).rowcount
+            self._db.execute("COMMIT")
+        return requeued
+
+    def claim(self, limit, leased_by=None, lease_seconds=None, prefix=None):
+        # prefix restricts the claim to jobs whose key starts with it (one market's jobs).
+        now = time.time()
+        lease_expires = now + lease_seconds if lease_seconds else None
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if prefix:
+                    rows = self._db.execute(
+                        "SELECT id, term FROM jobs WHERE state = ? AND term >= ? AND term < ? ORDER BY id LIMIT ?",
+                        (STATE_PENDING, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), limit)
+                    ).fetchall()
+                else:
+                    rows = self._db.execute(
+                        "SELECT id, term FROM jobs WHERE state = ? ORDER BY id LIMIT ?",
+                        (STATE_PENDING, limit)
+                    ).fetchall()
+                self._db.executemany(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ?,"
+                    " leased_by = ?, lease_expires = ? WHERE id = ?",
+                    ((STATE_IN_FLIGHT, now, leased_by, lease_expires, row[0]) for row in rows)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [row[1] for row in rows]
+
+    def renew_leases(self, leased_by, terms, lease_seconds):
+        expires = time.time() + lease_seconds
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET lease_expires = ? WHERE term = ? AND state = ? AND leased_by = ?",
+                ((expires, term, STATE_IN_FLIGHT, leased_by) for term in terms)
+            )
+
+    def expire_leases(self):
+        # Leased work whose worker stopped renewing goes back to pending.
+        now = time.time()
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET state = ?, leased_by = NULL, lease_expires = NULL, updated_at = ?"
+                " WHERE state = ? AND lease_expires IS NOT NULL AND lease_expires < ?",
+                (STATE_PENDING, now, STATE_IN_FLIGHT, now)
+            ).rowcount
+
+    def iter_pending(self, batch_size=500, prefix=None):
+        # Lazily claims pending terms batch by batch.
+        while True:
+            terms = self.claim(batch_size, prefix=prefix)
+            if not terms:
+                return
+            yield from terms
+
+    # With leased_by, mark_done/mark_failed only update a job that worker still
+    # holds in flight; they return False for a stale result (the lease expired
+    # and the term went to someone else).
+    def mark_done(self, term, product_count, leased_by=None):
+        return self._finish(term, leased_by,
+                            "state = ?, product_count = ?, last_error = NULL", (STATE_DONE, product_count))
+
+    def mark_failed(self, term, error=None, leased_by=None):
+        return self._finish(term, leased_by, "state = ?, last_error = ?", (STATE_FAILED, error))
+
+    def _finish(self, term, leased_by, assignments, values):
+        query = f"UPDATE jobs SET {assignments}, updated_at = ?, leased_by = NULL, lease_expires = NULL WHERE term = ?"
+        params = (*values, time.time(), term)
+        if leased_by is not None:
+            query += " AND leased_by = ? AND state = ?"
+            params += (leased_by, STATE_IN_FLIGHT)
+        with self._lock:
+            return self._db.execute(query, params).rowcount > 0
+
+    def unfinished(self):
+        # Jobs a run left pending or in flight: an interrupted run to resume.
+        counts = self.counts()
+        return counts[STATE_PENDING] + counts[STATE_IN_FLIGHT]
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {STATE_PENDING: 0, STATE_IN_FLIGHT: 0, STATE_DONE: 0, STATE_FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,59 +1,534 @@
+import asyncio
 import concurrent.futures
+import logging
 import os
+import queue
+import threading
 import time
 from scraper_classes import BingShopScraper, RequestsFetcher
-from tor import TorIPChanger
+from extractor import CardExtractor
 from colorama import Fore, Style, init
+import metrics
+from metrics import console, inc, observe
 
 init(autoreset=True)
 
 # --- Configuration ---
 CATEGORY_PATHS_FILE = "category_paths.txt" # Contains search terms
-MAX_PAGES_PER_CATEGORY = 1 # Only scraping one page per search term
+MAX_PAGES_PER_CATEGORY = 3 # Result pages per search term (pages 2..N are fetched concurrently)
+PAGE_FETCH_CONCURRENCY = 3 # Concurrent page fetches per search term
 USE_TOR = True
 TOR_CONTROL_PASSWORD = None
 
 MAX_CONCURRENT_WORKERS = 3
-BATCH_SIZE = 5
+WORK_QUEUE_SIZE = MAX_CONCURRENT_WORKERS # Terms queued ahead of the worker threads
+BATCH_SIZE = 5 # Terms handed out between throttle reports (and pauses, when the throttle is off)
+BATCH_PAUSE_SECONDS = 10 # Pause after every BATCH_SIZE terms when the adaptive throttle is off
+PAGE_RETRY_ATTEMPTS = 15
 TOR_SOCKS_PORT = 9050
 TOR_CONTROL_PORT = 9051
 
+# Direct (non-Tor) fetching: "httpx" shares one pooled HTTP/2 client across all
+# workers so connections survive from term to term; "requests" opens a session per term.
+HTTP_BACKEND = "httpx"
+HTTP2 = True
+HTTP_MAX_CONNECTIONS = MAX_CONCURRENT_WORKERS * PAGE_FETCH_CONCURRENCY
+HTTP_CLIENT = None
+STREAMING_FETCH = True # Read bodies in chunks and stop early on block/CAPTCHA pages
+
+# Shared Tor circuit pool: one control connection, one keep-alive session per circuit.
+USE_TOR_POOL = True
+TOR_POOL_SIZE = MAX_CONCURRENT_WORKERS
+TOR_SOCKS_PORTS = [TOR_SOCKS_PORT] # Add extra SocksPorts here to spread circuits
+TOR_NEWNYM_INTERVAL = None # Seconds between background NEWNYM signals (None = never)
+TOR_MIN_CIRCUIT_HEALTH = 0.5 # Circuits whose recent success rate drops below this get a new exit
+TOR_POOL = None
+
+# Retries: a term whose page fails or is blocked goes back into a delay queue
+# (exponential backoff with jitter) and is handed to the next free worker once
+# its delay has passed, so no worker sleeps between attempts. False = retry in
+# place, as before.
+REQUEUE_RETRIES = True
+RETRY_BASE_DELAY = 5.0 # Seconds before the first retry; doubles with each further one
+RETRY_MAX_DELAY = 300.0
+RETRY_JITTER = 0.5 # Share of each delay that is random
+
+EXTRACTION_ENGINE = "lxml" # "bs4" or "lxml" (fast path); see bench/bench_extractor.py
+EXTRACTOR = CardExtractor(EXTRACTION_ENGINE)
+
+# asyncio engine: thousands of terms in flight on one event loop. Opt-in: it has
+# no response cache, Tor circuit pool or multi-market support.
+USE_ASYNC = False
+ASYNC_CONCURRENCY = 50 # Terms in flight at once
+ASYNC_QUEUE_SIZE = 1000 # Max terms buffered ahead of the workers
+
+# Parse pipeline: fetch threads hand raw HTML to a process pool for parsing.
+USE_PARSE_PIPELINE = False
+PARSE_WORKERS = os.cpu_count() or 1
+FETCH_QUEUE_DEPTH = 100 # Terms buffered ahead of the fetch threads
+PARSE_QUEUE_DEPTH = PARSE_WORKERS * 4 # Pages waiting for/in the parse pool before fetchers block
+
+# Output: "ndjson" (append-only, batched fsync), "json" (one pretty-printed file per term)
+# or "parquet" (one row per product, date-partitioned; needs pyarrow).
+OUTPUT_MODE = "ndjson"
+OUTPUT_DIR = "out"
+NDJSON_COMPRESSION = None # None, "gzip" or "zstd"
+NDJSON_MAX_BYTES = 256 * 1024 * 1024 # Rotate output files at this size (uncompressed)
+NDJSON_FLUSH_EVERY = 500 # Records per flush/fsync
+PARQUET_ROW_GROUP_SIZE = 100_000 # Product rows per row group
+PARQUET_COMPRESSION = "zstd"
+OUTPUT_SINK = None
+
+# Change detection: compare each term's products with the last run and only
+# write added / removed / price-changed records.
+CHANGE_DETECTION = False
+CHANGE_STATE_PATH = "state.sqlite"
+
+# Normalization stage: numeric price + currency, canonical (unwrapped) links and
+# dedup of products across selectors, pages and terms before anything is written.
+NORMALIZE_PRODUCTS = False
+DEDUP_MODE = "bloom" # "bloom" (fixed memory), "exact" (grows with the run) or None (per term only)
+DEDUP_CAPACITY = 10_000_000 # Distinct products the bloom filter is sized for
+DEDUP_ERROR_RATE = 0.001 # Bloom filter false-positive rate at capacity
+
+# On-disk response cache (compressed bodies keyed by normalized URL).
+USE_RESPONSE_CACHE = False
+RESPONSE_CACHE_DIR = ".cache/responses"
+RESPONSE_CACHE_TTL = 24 * 3600 # Seconds
+RESPONSE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+CACHE_OFFLINE = False # Re-parse from cache only, never hit the network
+RESPONSE_CACHE = None
+
+# Adaptive throttle shared by all workers: token bucket + AIMD concurrency control.
+# When enabled it replaces the fixed sleeps between retries and batches.
+USE_ADAPTIVE_THROTTLE = True
+RATE_LIMIT_PER_SEC = 2.0 # Starting request rate
+MAX_RATE_PER_SEC = 8.0
+MIN_RATE_PER_SEC = RATE_LIMIT_PER_SEC / 8 # Blocks never slow the rate below this
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = MAX_CONCURRENT_WORKERS
+THROTTLE = None
+
+# Durable job store: per-term state so an interrupted run can be resumed where it stopped.
+USE_JOB_STORE = True
+JOB_STORE_PATH = "jobs.sqlite"
+JOB_MAX_ATTEMPTS = 3 # Runs a failed term is retried in before it is left as failed
+RESUME_JOBS = None # None: resume a run that was interrupted, else start fresh; True: always resume; False: always start fresh
+INGEST_TERMS = True # False: only resume what is already in the job store
+JOB_STORE = None
+
+# Markets: every term is scraped in each of these Bing markets (see markets.py)
+# at the same time, as one job per term x market. Each market gets its own
+# fetchers, Tor circuits and throttle, and MAX_CONCURRENT_WORKERS threads.
+# None = the original single cc=us search.
+MARKETS = None # e.g. ["us", "gb", "de", "fr"]
+MARKET_POOLS = {} # Market code -> its throttle, HTTP client and Tor pool during a run
+
+# --- Observability ---
+QUIET = False # No per-thread console output; JSON log lines on stderr instead
+LOG_LEVEL = "INFO" # Quiet mode log level
+METRICS_EXPORT = None # None, "prometheus" (serves /metrics) or "json" (periodic snapshots)
+METRICS_PORT = 9108
+METRICS_HOST = "127.0.0.1" # "0.0.0.0" to let a Prometheus server on another host scrape it
+METRICS_SNAPSHOT_FILE = "out/metrics.ndjson"
+METRICS_SNAPSHOT_INTERVAL = 30 # Seconds
+METRICS_EXPORTER = None
+
 # --- Main Runner Script Logic ---
-def load_search_terms(file_path):
+def iter_search_terms(file_path):
+    # Streams terms lazily instead of loading the whole file.
     if not os.path.exists(file_path):
         raise FileNotFoundError(Fore.RED + f"File {file_path} not found!")
-    with open(file_path, "r", encoding="utf-8") as f:
-        terms = [line.strip() for line in f if line.strip()]
-    if not terms:
+    if os.path.getsize(file_path) == 0:
         raise ValueError(Fore.RED + "Search terms file is empty!")
-    return terms
 
-def process_search_term(search_term_input):
+    def generate():
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                term = line.strip()
+                if term:
+                    yield term
+    return generate()
+
+def retry_attempts_for_run():
+    # Retrying cannot help when pages only come from the cache.
+    return 0 if CACHE_OFFLINE else PAGE_RETRY_ATTEMPTS
+
+def build_tor_fetcher(custom_headers=None):
+    from tor import TorIPChanger
+    return TorIPChanger(
+        tor_socks_port=TOR_SOCKS_PORT,
+        tor_control_port=TOR_CONTROL_PORT,
+        control_password=TOR_CONTROL_PASSWORD,
+        custom_headers=custom_headers,
+        streaming=STREAMING_FETCH
+    )
+
+def wrap_fetcher(fetcher_instance, attempt=0):
+    # A requeued attempt gets a new wrapper, so it cannot tell it is a retry; go to the network.
+    if RESPONSE_CACHE is None:
+        return fetcher_instance
+    from response_cache import CachingFetcher
+    return CachingFetcher(fetcher_instance, RESPONSE_CACHE, offline=CACHE_OFFLINE, refresh=attempt > 0)
+
+def market_pool(market):
+    # The throttle, shared HTTP client and Tor pool a term in this market uses.
+    if market is None:
+        return {"throttle": THROTTLE, "http_client": HTTP_CLIENT, "tor_pool": TOR_POOL}
+    return MARKET_POOLS[market.code]
+
+def process_search_term(search_term_input, market=None, attempt=0, requeue=False):
     search_term = search_term_input
+    pool = market_pool(market)
+    headers = market.headers() if market is not None else None
     
     thread_name = concurrent.futures.thread.threading.current_thread().name
-    print(Fore.MAGENTA + f"Thread {thread_name}: Processing search term: {Style.BRIGHT}{search_term}{Style.RESET_ALL}" +
-          Fore.MAGENTA + f" (Tor: {USE_TOR})")
+    console(Fore.MAGENTA + f"Thread {thread_name}: Processing search term: {Style.BRIGHT}{search_term}{Style.RESET_ALL}" +
+            Fore.MAGENTA + f" (Tor: {USE_TOR}" + (f", market: {market.code})" if market else ")"),
+            "term_started", logging.DEBUG, term=search_term, market=market.code if market else None)
     
+    if USE_TOR and pool["tor_pool"] is not None:
+        with pool["tor_pool"].lease() as circuit:
+            return BingShopScraper(
+                search_term=search_term,
+                fetcher_instance=wrap_fetcher(circuit, attempt),
+                page_retry_attempts=retry_attempts_for_run(),
+                max_pages=MAX_PAGES_PER_CATEGORY,
+                page_concurrency=PAGE_FETCH_CONCURRENCY,
+                extractor=EXTRACTOR,
+                output_sink=OUTPUT_SINK,
+                throttle=pool["throttle"],
+                market=market,
+                first_attempt=attempt,
+                requeue=requeue
+            ).scrape()
+
     fetcher_instance = None
     if USE_TOR:
-        fetcher_instance = TorIPChanger(
-            tor_socks_port=TOR_SOCKS_PORT,
-            tor_control_port=TOR_CONTROL_PORT,
-            control_password=TOR_CONTROL_PASSWORD
-        )
+        fetcher_instance = build_tor_fetcher(custom_headers=headers)
     else:
-        fetcher_instance = RequestsFetcher()
+        fetcher_instance = pool["http_client"] or RequestsFetcher(streaming=STREAMING_FETCH, custom_headers=headers)
+    fetcher_instance = wrap_fetcher(fetcher_instance, attempt)
     
     scraper = BingShopScraper(
         search_term=search_term,
         fetcher_instance=fetcher_instance,
-        page_retry_attempts=15 # Increased retry attempts
+        page_retry_attempts=retry_attempts_for_run(),
+        max_pages=MAX_PAGES_PER_CATEGORY,
+        page_concurrency=PAGE_FETCH_CONCURRENCY,
+        extractor=EXTRACTOR,
+        output_sink=OUTPUT_SINK,
+        throttle=pool["throttle"],
+        market=market,
+        first_attempt=attempt,
+        requeue=requeue
     )
     result = scraper.scrape()
     return result
 
+def report_result(term, result):
+    # With normalization on, product_count and products are what was written
+    # after dedup; a term whose products were all duplicates still counts as done.
+    duplicates = result.get("duplicates_dropped", 0) if result else 0
+    if JOB_STORE is not None:
+        if result and (result.get("products") or duplicates):
+            # The output sink may still be buffering the record (NDJSON flushes
+            # in batches): the term only counts as done once its output is on
+            # disk, so a run killed before that scrapes it again.
+            job_store, product_count = JOB_STORE, result["product_count"]
+            OUTPUT_SINK.after_flush(lambda: job_store.mark_done(term, product_count))
+        else:
+            JOB_STORE.mark_failed(term, "no products")
+    if result and result.get("products"):
+        location = OUTPUT_SINK.location_for(result) if OUTPUT_SINK else "out/"
+        console(Fore.GREEN + f"[{term}] Found {len(result['products'])} items" +
+                (f" ({duplicates} duplicates dropped)" if duplicates else "") + f". Saved to {location}",
+                "term_done", term=term, products=len(result["products"]), duplicates=duplicates, location=location)
+    elif duplicates:
+        console(Fore.YELLOW + f"[{term}] Found {duplicates} items, all duplicates of products already written.",
+                "term_duplicates", term=term, duplicates=duplicates)
+    elif result and result.get("product_count") == 0:
+        console(Fore.YELLOW + f"[{term}] No items found.", "term_empty", logging.WARNING, term=term)
+    else:
+        console(Fore.YELLOW + f"[{term}] No items found or issue occurred.", "term_failed", logging.WARNING, term=term)
+
+def report_error(term, error):
+    if JOB_STORE is not None:
+        JOB_STORE.mark_failed(term, str(error))
+
+def build_async_fetcher():
+    from async_fetcher import AsyncFetcher
+    if USE_TOR:
+        identity_changer = build_tor_fetcher()
+        return AsyncFetcher(
+            max_connections=ASYNC_CONCURRENCY,
+            proxy_url=f"socks5://127.0.0.1:{TOR_SOCKS_PORT}",
+            identity_changer=identity_changer
+        )
+    return AsyncFetcher(max_connections=ASYNC_CONCURRENCY)
+
+async def process_search_term_async(search_term, fetcher_instance, attempt=0, requeue=False):
+    scraper = BingShopScraper(
+        search_term=search_term,
+        fetcher_instance=fetcher_instance,
+        page_retry_attempts=retry_attempts_for_run(),
+        max_pages=MAX_PAGES_PER_CATEGORY,
+        page_concurrency=PAGE_FETCH_CONCURRENCY,
+        extractor=EXTRACTOR,
+        output_sink=OUTPUT_SINK,
+        throttle=THROTTLE,
+        first_attempt=attempt,
+        requeue=requeue
+    )
+    return await scraper.scrape_async()
+
+async def run_async(search_terms):
+    # Same scheme as process_terms(): workers pull (term, attempt) pairs from a
+    # bounded queue that the producer fills with due retries first, then new terms.
+    fetcher_instance = build_async_fetcher()
+    retries = build_retry_queue() if REQUEUE_RETRIES else None
+    work = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    finished = asyncio.Condition()
+    outstanding = 0
+
+    async def producer():
+        nonlocal outstanding
+        terms = iter(search_terms)
+        while True:
+            due = retries.pop_due(1) if retries is not None else []
+            if due:
+                job = due[0]
+            else:
+                term = next(terms, None)
+                job = (term, 0) if term is not None else None
+            if job is None:
+                async with finished:
+                    if not outstanding and not retries:
+                        break
+                    try:
+                        await asyncio.wait_for(finished.wait(), retries.next_due_in() if retries else None)
+                    except asyncio.TimeoutError:
+                        pass
+                continue
+            outstanding += 1
+            await work.put(job)
+        for _ in range(ASYNC_CONCURRENCY):
+            await work.put(None)
+
+    async def worker():
+        nonlocal outstanding
+        while True:
+            job = await work.get()
+            if job is None:
+                return
+            term, attempt = job
+            try:
+                result = await process_search_term_async(term, fetcher_instance, attempt, retries is not None)
+                if result and result.get("retry_attempt"):
+                    schedule_retry(retries, term, result["retry_attempt"])
+                else:
+                    report_result(term, result)
+            except Exception as e:
+                report_error(term, e)
+                console(Fore.RED + f"[{term}] Error during async processing: {e}", "term_error", logging.ERROR, term=term, error=str(e))
+            finally:
+                async with finished:
+                    outstanding -= 1
+                    finished.notify()
+
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(ASYNC_CONCURRENCY)))
+    finally:
+        await fetcher_instance.close()
+
+def make_pipeline_fetcher():
+    if USE_TOR and TOR_POOL is not None:
+        return wrap_fetcher(TOR_POOL.acquire())
+    if USE_TOR:
+        return wrap_fetcher(build_tor_fetcher())
+    return wrap_fetcher(HTTP_CLIENT or RequestsFetcher(streaming=STREAMING_FETCH))
+
+def release_pipeline_fetcher(fetcher_instance):
+    fetcher_instance = getattr(fetcher_instance, 'inner_fetcher', fetcher_instance)
+    if TOR_POOL is not None and fetcher_instance in TOR_POOL.circuits:
+        TOR_POOL.release(fetcher_instance)
+
+def run_pipeline(search_terms):
+    from pipeline import ParsePipeline
+    pipeline = ParsePipeline(
+        make_fetcher=make_pipeline_fetcher,
+        release_fetcher=release_pipeline_fetcher,
+        fetch_workers=MAX_CONCURRENT_WORKERS,
+        parse_workers=PARSE_WORKERS,
+        fetch_queue_depth=FETCH_QUEUE_DEPTH,
+        parse_queue_depth=PARSE_QUEUE_DEPTH,
+        engine=EXTRACTION_ENGINE,
+        page_retry_attempts=retry_attempts_for_run(),
+        output_sink=OUTPUT_SINK,
+        throttle=THROTTLE,
+        on_result=report_result,
+        retry_queue=build_retry_queue(),
+        max_pages=MAX_PAGES_PER_CATEGORY
+    )
+    pipeline.run(search_terms)
+
+def build_tor_pool(custom_headers=None):
+    from tor_pool import TorCircuitPool
+    return TorCircuitPool(
+        size=TOR_POOL_SIZE,
+        socks_ports=TOR_SOCKS_PORTS,
+        control_port=TOR_CONTROL_PORT,
+        control_password=TOR_CONTROL_PASSWORD,
+        newnym_interval=TOR_NEWNYM_INTERVAL,
+        custom_headers=custom_headers,
+        streaming=STREAMING_FETCH,
+        min_health=TOR_MIN_CIRCUIT_HEALTH,
+        connections_per_circuit=PAGE_FETCH_CONCURRENCY
+    )
+
+def build_http_client(custom_headers=None):
+    # Returns None (one requests session per term) when httpx is not wanted or not installed.
+    if HTTP_BACKEND != "httpx":
+        return None
+    from http_client import SharedHttpFetcher, httpx
+    if httpx is None:
+        print(Fore.YELLOW + "httpx is not installed (pip install 'httpx[http2,brotli,zstd]'); using a requests session per term.")
+        return None
+    client = SharedHttpFetcher(max_connections=HTTP_MAX_CONNECTIONS, http2=HTTP2, custom_headers=custom_headers,
+                               streaming=STREAMING_FETCH)
+    print(Fore.BLUE + f"Shared HTTP client: httpx, {HTTP_MAX_CONNECTIONS} connections, HTTP/2 {'on' if client.http2 else 'off'}" +
+          ("" if client.http2 or not HTTP2 else " (pip install h2 to enable)"))
+    return client
+
+def build_output_sink():
+    from sinks import build_sink
+    if OUTPUT_MODE == "ndjson":
+        sink = build_sink(
+            "ndjson",
+            out_dir=OUTPUT_DIR,
+            compression=NDJSON_COMPRESSION,
+            max_bytes=NDJSON_MAX_BYTES,
+            flush_every=NDJSON_FLUSH_EVERY
+        )
+    elif OUTPUT_MODE == "parquet":
+        sink = build_sink(
+            "parquet",
+            out_dir=OUTPUT_DIR,
+            row_group_size=PARQUET_ROW_GROUP_SIZE,
+            compression=PARQUET_COMPRESSION
+        )
+    else:
+        sink = build_sink(OUTPUT_MODE, out_dir=OUTPUT_DIR)
+    if CHANGE_DETECTION:
+        from change_tracker import ChangeSink, ChangeTracker
+        tracker = ChangeTracker(CHANGE_STATE_PATH)
+        print(Fore.BLUE + f"Change detection: {CHANGE_STATE_PATH} {tracker.stats()}")
+        sink = ChangeSink(tracker, sink)
+    if NORMALIZE_PRODUCTS:
+        from normalize import NormalizingSink, ProductNormalizer, build_dedup
+        # Change detection diffs each term against its own last state, so a product
+        # must not be dropped from one term because another term got to it first.
+        dedup_mode = None if CHANGE_DETECTION else DEDUP_MODE
+        dedup = build_dedup(dedup_mode, DEDUP_CAPACITY, DEDUP_ERROR_RATE)
+        if CHANGE_DETECTION and DEDUP_MODE is not None:
+            print(Fore.YELLOW + "Change detection is on: products are only deduplicated within each term.")
+        elif dedup_mode == "bloom":
+            print(Fore.BLUE + f"Product dedup: bloom filter, {dedup.size_bytes / 1024 / 1024:.1f} MB for {DEDUP_CAPACITY} products")
+        sink = NormalizingSink(ProductNormalizer(dedup), sink)
+    return sink
+
+def build_response_cache():
+    from response_cache import ResponseCache
+    return ResponseCache(
+        cache_dir=RESPONSE_CACHE_DIR,
+        ttl=None if CACHE_OFFLINE else RESPONSE_CACHE_TTL,
+        max_bytes=RESPONSE_CACHE_MAX_BYTES
+    )
+
+def build_throttle(market=None):
+    from rate_limit import AdaptiveThrottle
+    throttle = AdaptiveThrottle(
+        rate=RATE_LIMIT_PER_SEC,
+        max_rate=MAX_RATE_PER_SEC,
+        min_rate=MIN_RATE_PER_SEC,
+        initial_concurrency=MIN_CONCURRENCY,
+        min_concurrency=MIN_CONCURRENCY,
+        max_concurrency=ASYNC_CONCURRENCY if USE_ASYNC else MAX_CONCURRENCY
+    )
+    labels = {"market": market.code} if market else {}
+    for key in ("concurrency_limit", "rate_per_sec", "block_rate"):
+        metrics.METRICS.set_gauge("throttle_" + key, lambda key=key: throttle.metrics()[key], **labels)
+    return throttle
+
+def build_retry_queue():
+    from rate_limit import RetryQueue
+    return RetryQueue(base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, jitter=RETRY_JITTER)
+
+def print_circuit_health(tor_pool, market=None):
+    health = tor_pool.health()
+    label = f"Tor circuits [{market.code}]" if market else "Tor circuits"
+    summary = ", ".join(f"#{c['circuit']} {c['score']:.2f}" + (f" ({c['rotations']} rotations)" if c["rotations"] else "")
+                        for c in health)
+    console(Fore.BLUE + f"{label}: {summary}", "tor_circuits", market=market.code if market else None, circuits=health)
+
+def print_throttle_metrics(throttle=None, market=None):
+    throttle = throttle or THROTTLE
+    if throttle is not None:
+        label = f"Throttle [{market.code}]" if market else "Throttle"
+        console(Fore.BLUE + f"{label}: {throttle.metrics()}", "throttle", market=market.code if market else None,
+                **throttle.metrics())
+
+def start_metrics_export():
+    if METRICS_EXPORT == "prometheus":
+        exporter = metrics.PrometheusExporter(port=METRICS_PORT, host=METRICS_HOST)
+        print(Fore.BLUE + f"Prometheus metrics on {METRICS_HOST}:{METRICS_PORT}/metrics")
+        return exporter
+    if METRICS_EXPORT == "json":
+        exporter = metrics.JsonSnapshotWriter(METRICS_SNAPSHOT_FILE, interval=METRICS_SNAPSHOT_INTERVAL)
+        print(Fore.BLUE + f"Metrics snapshots every {METRICS_SNAPSHOT_INTERVAL}s to {METRICS_SNAPSHOT_FILE}")
+        return exporter
+    if METRICS_EXPORT is not None:
+        raise ValueError(f"Unknown metrics export: {METRICS_EXPORT}")
+    return None
+
+def print_metrics_summary():
+    snapshot = metrics.METRICS.snapshot()
+    pages = sum(entry["value"] for entry in snapshot["counters"].get("page_outcomes_total", []))
+    fetch = snapshot["histograms"].get("fetch_seconds", [])
+    fetch_p50 = max((entry["p50"] or 0 for entry in fetch), default=0)
+    retries = sum(entry["value"] for entry in snapshot["counters"].get("retries_total", []))
+    summary = f"{pages} pages, block rate {snapshot['block_rate']:.1%}, {retries} retries, fetch p50 {fetch_p50 * 1000:.0f} ms"
+    console(Fore.BLUE + f"Metrics: {summary}", "metrics_summary", pages=pages, block_rate=snapshot["block_rate"],
+            retries=retries, fetch_p50=fetch_p50)
+
+def selected_markets():
+    if not MARKETS:
+        return []
+    from markets import get_markets
+    return get_markets(MARKETS)
+
+def open_job_store():
+    from job_store import JobStore
+    store = JobStore(JOB_STORE_PATH, max_attempts=JOB_MAX_ATTEMPTS)
+    unfinished = store.unfinished()
+    if RESUME_JOBS is False or (RESUME_JOBS is None and not unfinished):
+        store.reset()
+    elif unfinished:
+        print(Fore.BLUE + f"Resuming the last run: {unfinished} terms unfinished (--fresh starts over)")
+    markets = [market.code for market in selected_markets()]
+    added = store.ingest(CATEGORY_PATHS_FILE, markets=markets) if INGEST_TERMS else 0
+    requeued = store.recover()
+    counts = store.counts()
+    if not any(counts.values()):
+        store.close()
+        raise ValueError(Fore.RED + ("Search terms file is empty!" if INGEST_TERMS else f"Job store {JOB_STORE_PATH} is empty!"))
+    print(Fore.BLUE + f"Job store {JOB_STORE_PATH}: {added} new terms, {requeued} requeued, "
+          f"{counts['done']} done, {counts['failed']} failed, {counts['pending']} pending")
+    return store
+
 def main():
+    global OUTPUT_SINK, RESPONSE_CACHE, THROTTLE, JOB_STORE, METRICS_EXPORTER
+    metrics.set_quiet(QUIET, level=getattr(logging, LOG_LEVEL.upper(), logging.INFO))
     if USE_TOR:
         try:
             import stem
@@ -64,50 +539,240 @@ def main():
             return
 
     try:
-        search_terms_list = load_search_terms(CATEGORY_PATHS_FILE)
+        markets = selected_markets()
+        if USE_JOB_STORE:
+            JOB_STORE = open_job_store()
+            search_terms = JOB_STORE.iter_pending()
+            total_terms = JOB_STORE.counts()["pending"]
+        else:
+            search_terms = iter_search_terms(CATEGORY_PATHS_FILE)
+            total_terms = None
+        if markets:
+            print(Fore.BLUE + f"Markets: {', '.join(market.code for market in markets)}")
     except (FileNotFoundError, ValueError) as e:
         print(e)
         return
 
-    total_terms = len(search_terms_list)
-    print(Fore.BLUE + Style.BRIGHT + f"Total search terms to process: {total_terms}")
-    print(Fore.BLUE + f"Batch size: {BATCH_SIZE}")
-    print(Fore.BLUE + f"Max concurrent workers: {MAX_CONCURRENT_WORKERS}")
+    print(Fore.BLUE + Style.BRIGHT + f"Total search terms to process: {total_terms if total_terms is not None else 'streaming'}")
+    OUTPUT_SINK = build_output_sink()
+    print(Fore.BLUE + f"Output mode: {OUTPUT_MODE} ({OUTPUT_DIR}/)")
+    if USE_RESPONSE_CACHE or CACHE_OFFLINE:
+        RESPONSE_CACHE = build_response_cache()
+        print(Fore.BLUE + f"Response cache: {RESPONSE_CACHE_DIR} {RESPONSE_CACHE.stats()}" +
+              (" (offline, re-parsing from cache)" if CACHE_OFFLINE else ""))
+    if USE_ADAPTIVE_THROTTLE and not MARKETS:
+        THROTTLE = build_throttle()
+        print(Fore.BLUE + f"Adaptive throttle: start {RATE_LIMIT_PER_SEC} req/s ({MIN_RATE_PER_SEC}..{MAX_RATE_PER_SEC}), concurrency {THROTTLE.min_concurrency}..{THROTTLE.max_concurrency}")
+    try:
+        METRICS_EXPORTER = start_metrics_export()
+        run_terms(search_terms)
+        print_throttle_metrics()
+        print_metrics_summary()
+    finally:
+        if METRICS_EXPORTER is not None:
+            METRICS_EXPORTER.close()
+            METRICS_EXPORTER = None
+        THROTTLE = None
+        # Closing the sink flushes the last records and marks their terms done.
+        OUTPUT_SINK.close()
+        OUTPUT_SINK = None
+        if JOB_STORE is not None:
+            print(Fore.BLUE + f"Job store: {JOB_STORE.counts()}")
+            JOB_STORE.close()
+            JOB_STORE = None
+        if RESPONSE_CACHE is not None:
+            RESPONSE_CACHE.close()
+            RESPONSE_CACHE = None
+    print(Fore.GREEN + Style.BRIGHT + "\nAll search terms processed.")
+
+def run_terms(search_terms):
+    global TOR_POOL, HTTP_CLIENT
+    if MARKETS:
+        if USE_ASYNC or USE_PARSE_PIPELINE:
+            print(Fore.YELLOW + "Multi-market runs use the threaded engine; USE_ASYNC and USE_PARSE_PIPELINE are ignored.")
+        run_markets(selected_markets())
+        return
+    if USE_ASYNC:
+        if RESPONSE_CACHE is not None:
+            print(Fore.YELLOW + "Response cache is not used by the async engine.")
+        print(Fore.BLUE + f"Async engine, concurrency: {ASYNC_CONCURRENCY}, queue size: {ASYNC_QUEUE_SIZE}")
+        print(Fore.BLUE + f"Using Tor: {USE_TOR}")
+        print(Fore.CYAN + "-" * 40)
+        asyncio.run(run_async(search_terms))
+        return
+
+    if USE_TOR and USE_TOR_POOL:
+        TOR_POOL = build_tor_pool()
+        print(Fore.BLUE + f"Tor circuit pool: {TOR_POOL_SIZE} circuits over SOCKS ports {TOR_SOCKS_PORTS}")
+    if not USE_TOR:
+        HTTP_CLIENT = build_http_client()
+    try:
+        if USE_PARSE_PIPELINE:
+            print(Fore.BLUE + f"Parse pipeline: {MAX_CONCURRENT_WORKERS} fetch threads, {PARSE_WORKERS} parse processes")
+            print(Fore.BLUE + f"Fetch queue depth: {FETCH_QUEUE_DEPTH}, parse queue depth: {PARSE_QUEUE_DEPTH}")
+            print(Fore.CYAN + "-" * 40)
+            run_pipeline(search_terms)
+        else:
+            run_threaded(search_terms)
+    finally:
+        if TOR_POOL is not None:
+            print_circuit_health(TOR_POOL)
+            TOR_POOL.close()
+            TOR_POOL = None
+        if HTTP_CLIENT is not None:
+            HTTP_CLIENT.close()
+            HTTP_CLIENT = None
+
+def print_run_settings(workers_label="Max concurrent workers"):
+    print(Fore.BLUE + f"{workers_label}: {MAX_CONCURRENT_WORKERS}, {WORK_QUEUE_SIZE} terms queued ahead")
+    print(Fore.BLUE + f"Pages per term: {MAX_PAGES_PER_CATEGORY} ({PAGE_FETCH_CONCURRENCY} concurrent)")
     print(Fore.BLUE + f"Using Tor: {USE_TOR}")
     if USE_TOR:
         print(Fore.BLUE + f"Tor SOCKS Port: {TOR_SOCKS_PORT}, Tor Control Port: {TOR_CONTROL_PORT}")
+
+def run_threaded(search_terms):
+    print_run_settings()
     print(Fore.CYAN + "-" * 40)
+    process_terms(search_terms)
+
+def build_market_pool(market):
+    headers = market.headers()
+    pool = {"throttle": None, "http_client": None, "tor_pool": None}
+    if USE_ADAPTIVE_THROTTLE:
+        pool["throttle"] = build_throttle(market)
+    if USE_TOR and USE_TOR_POOL:
+        pool["tor_pool"] = build_tor_pool(custom_headers=headers)
+    if not USE_TOR:
+        pool["http_client"] = build_http_client(custom_headers=headers)
+    return pool
+
+def market_jobs(market):
+    # This market's share of the term x market matrix, as job keys.
+    from markets import job_key
+    if JOB_STORE is not None:
+        return JOB_STORE.iter_pending(prefix=job_key("", market.code))
+    return (job_key(term, market.code) for term in iter_search_terms(CATEGORY_PATHS_FILE))
 
-    for i in range(0, total_terms, BATCH_SIZE):
-        batch_terms = search_terms_list[i:i+BATCH_SIZE]
-        current_batch_num = i // BATCH_SIZE + 1
-        total_batches = (total_terms + BATCH_SIZE - 1) // BATCH_SIZE
-        print(Fore.CYAN + Style.BRIGHT + 
-              f"\n--- Processing Batch {current_batch_num} of {total_batches} ({len(batch_terms)} terms) ---")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS) as executor:
-            future_to_term = {executor.submit(process_search_term, term): term for term in batch_terms}
-
-            for future in concurrent.futures.as_completed(future_to_term):
-                term = future_to_term[future]
+def run_markets(markets):
+    # One work queue per market, all running at once; a slow or throttled
+    # market only holds up its own terms.
+    global MARKET_POOLS
+    print_run_settings("Concurrent workers per market")
+    if USE_ADAPTIVE_THROTTLE:
+        print(Fore.BLUE + f"Adaptive throttle per market: start {RATE_LIMIT_PER_SEC} req/s ({MIN_RATE_PER_SEC}..{MAX_RATE_PER_SEC})")
+    try:
+        for market in markets:
+            MARKET_POOLS[market.code] = build_market_pool(market)
+        print(Fore.CYAN + "-" * 40)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(markets), thread_name_prefix="market") as executor:
+            futures = {executor.submit(process_terms, market_jobs(market), market): market for market in markets}
+            for future in concurrent.futures.as_completed(futures):
                 try:
-                    result = future.result()
-                    if result and result.get("products"):
-                        filename_prefix_for_log = "".join(c if c.isalnum() else "_" for c in term)
-                        print(Fore.GREEN + f"[{term}] Found {len(result['products'])} items. Saved to out/{filename_prefix_for_log}_{result['timestamp']}.json")
-                    elif result and result.get("product_count") == 0:
-                        print(Fore.YELLOW + f"[{term}] No items found.")
-                    else:
-                        print(Fore.YELLOW + f"[{term}] No items found or issue occurred.")
+                    future.result()
                 except Exception as e:
-                    print(Fore.RED + f"[{term}] Error during processing in thread: {e}")
-        
-        print(Fore.CYAN + Style.BRIGHT + f"--- Batch {current_batch_num} completed ---")
-        if i + BATCH_SIZE < total_terms:
-            print(Fore.BLUE + "Waiting a few seconds before next batch...")
-            time.sleep(10) 
+                    market = futures[future]
+                    console(Fore.RED + f"Market {market.code} stopped: {e}", "market_error", logging.ERROR,
+                            market=market.code, error=str(e))
+    finally:
+        for market in markets:
+            pool = MARKET_POOLS.get(market.code)
+            if pool is None:
+                continue
+            if pool["tor_pool"] is not None:
+                print_circuit_health(pool["tor_pool"], market)
+                pool["tor_pool"].close()
+            if pool["http_client"] is not None:
+                pool["http_client"].close()
+        MARKET_POOLS = {}
 
-    print(Fore.GREEN + Style.BRIGHT + "\nAll search terms processed.")
+def schedule_retry(retries, term, attempt):
+    delay = retries.push(term, attempt)
+    inc("retries_scheduled_total")
+    observe("retry_delay_seconds", delay)
+    console(Fore.YELLOW + f"[{term}] Requeued: retry {attempt}/{retry_attempts_for_run()} in {delay:.1f}s.",
+            "retry_scheduled", term=term, attempt=attempt, delay=round(delay, 1))
+
+def process_term_job(term, attempt, market=None, retries=None):
+    # One attempt at one term, on a worker thread. An attempt that failed but may
+    # be retried goes back into the retry queue instead of being reported.
+    from markets import split_job_key
+    try:
+        result = process_search_term(split_job_key(term)[1] if market else term, market, attempt, retries is not None)
+        if result and result.get("retry_attempt"):
+            schedule_retry(retries, term, result["retry_attempt"])
+            return
+        report_result(term, result)
+    except Exception as e:
+        report_error(term, e)
+        console(Fore.RED + f"[{term}] Error during processing in thread: {e}",
+                "term_error", logging.ERROR, term=term, error=str(e))
+
+def process_terms(search_terms, market=None):
+    # Worker threads pull (term, attempt) pairs from one bounded queue that this
+    # thread keeps topped up: retries whose backoff has passed first, then new
+    # terms. There is no batch barrier, so a slow term only holds up its own
+    # worker. With a market, search_terms are job keys ("<market>:<term>").
+    search_terms = iter(search_terms)
+    throttle = market_pool(market)["throttle"]
+    retries = build_retry_queue() if REQUEUE_RETRIES else None
+    work = queue.Queue(maxsize=max(1, WORK_QUEUE_SIZE))
+    finished = threading.Condition()
+    outstanding = 0 # Handed out and not finished; a running term may still requeue itself
+
+    def work_loop():
+        nonlocal outstanding
+        while True:
+            job = work.get()
+            if job is None:
+                return
+            try:
+                process_term_job(*job, market, retries)
+            finally:
+                with finished:
+                    outstanding -= 1
+                    finished.notify()
+
+    def next_job():
+        due = retries.pop_due(1) if retries is not None else []
+        if due:
+            return due[0]
+        term = next(search_terms, None)
+        return (term, 0) if term is not None else None
+
+    handed_out = 0
+    prefix = f"worker-{market.code}" if market else "worker"
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS, thread_name_prefix=prefix) as executor:
+        for _ in range(MAX_CONCURRENT_WORKERS):
+            executor.submit(work_loop)
+        try:
+            while True:
+                job = next_job()
+                if job is None:
+                    # Nothing to hand out: wait for a running term to finish (it
+                    # may requeue itself) or for the next retry to come due.
+                    with finished:
+                        if not outstanding and not retries:
+                            break
+                        wait = retries.next_due_in() if retries else None
+                        if wait and not outstanding:
+                            console(Fore.BLUE + f"Waiting {wait:.1f}s for {len(retries)} requeued terms...", "retry_wait",
+                                    logging.DEBUG, seconds=round(wait, 1), terms=len(retries))
+                        finished.wait(wait)
+                    continue
+                with finished:
+                    outstanding += 1
+                work.put(job)
+                handed_out += 1
+                if handed_out % max(1, BATCH_SIZE) == 0:
+                    print_throttle_metrics(throttle, market)
+                    if throttle is None and BATCH_PAUSE_SECONDS:
+                        console(Fore.BLUE + "Waiting a few seconds before handing out more terms...")
+                        time.sleep(BATCH_PAUSE_SECONDS)
+        finally:
+            for _ in range(MAX_CONCURRENT_WORKERS):
+                work.put(None)
+    if market is not None:
+        print_throttle_metrics(throttle, market)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
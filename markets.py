@@ -0,0 +1,50 @@
+JOB_KEY_SEPARATOR = ":"
+
+class Market:
+    # One Bing market: the cc/setlang query parameters plus the Accept-Language
+    # a browser in that locale would send.
+    def __init__(self, code, cc, language, accept_language=None):
+        self.code = code
+        self.cc = cc
+        self.language = language
+        self.accept_language = accept_language or f"{language},{language.split('-')[0]};q=0.9"
+
+    def url_params(self):
+        return {"cc": self.cc, "setlang": self.language}
+
+    def headers(self):
+        return {"Accept-Language": self.accept_language}
+
+    def __repr__(self):
+        return f"Market({self.code!r})"
+
+MARKETS = {market.code: market for market in (
+    Market("us", "us", "en-US", "en-US,en;q=0.9,en-GB;q=0.8"),
+    Market("gb", "gb", "en-GB", "en-GB,en;q=0.9,en-US;q=0.8"),
+    Market("ca", "ca", "en-CA", "en-CA,en;q=0.9,fr-CA;q=0.8"),
+    Market("au", "au", "en-AU", "en-AU,en;q=0.9"),
+    Market("in", "in", "en-IN", "en-IN,en;q=0.9,hi;q=0.8"),
+    Market("de", "de", "de-DE", "de-DE,de;q=0.9,en;q=0.8"),
+    Market("fr", "fr", "fr-FR", "fr-FR,fr;q=0.9,en;q=0.8"),
+    Market("es", "es", "es-ES", "es-ES,es;q=0.9,en;q=0.8"),
+    Market("it", "it", "it-IT", "it-IT,it;q=0.9,en;q=0.8"),
+    Market("nl", "nl", "nl-NL", "nl-NL,nl;q=0.9,en;q=0.8"),
+    Market("br", "br", "pt-BR", "pt-BR,pt;q=0.9,en;q=0.8"),
+    Market("mx", "mx", "es-MX", "es-MX,es;q=0.9,en;q=0.8"),
+    Market("jp", "jp", "ja-JP", "ja-JP,ja;q=0.9,en;q=0.8"),
+)}
+
+def get_markets(codes):
+    codes = list(dict.fromkeys(code.strip().lower() for code in codes))
+    unknown = [code for code in codes if code not in MARKETS]
+    if unknown:
+        raise ValueError(f"Unknown market(s): {', '.join(unknown)} (known: {', '.join(MARKETS)})")
+    return [MARKETS[code] for code in codes]
+
+# Multi-market runs keep one job per term x market, keyed "<market>:<term>".
+def job_key(term, market_code):
+    return f"{market_code}{JOB_KEY_SEPARATOR}{term}"
+
+def split_job_key(key):
+    market_code, _, term = key.partition(JOB_KEY_SEPARATOR)
+    return market_code, term
@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250)
+DELAY_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+METRIC_PREFIX = "bing_scraper_"
+
+METRIC_HELP = {
+    "fetch_seconds": "Time spent in fetcher.get(), by fetcher",
+    "fetch_responses_total": "HTTP responses, by fetcher and status code",
+    "fetch_errors_total": "Fetches that got no response at all",
+    "fetch_bytes_total": "Response body bytes received",
+    "fetch_aborted_total": "Streamed downloads stopped early on a block/CAPTCHA page",
+    "parse_seconds": "Time spent extracting product cards from one page",
+    "cards_found": "Product cards found per parsed page",
+    "page_outcomes_total": "Result pages by outcome (ok, empty, blocked, error)",
+    "retries_total": "Search retries after a failed or blocked first page",
+    "retries_scheduled_total": "Failed terms put back in the retry queue",
+    "retry_delay_seconds": "Backoff delay given to a requeued term",
+    "scrape_seconds": "Wall time to scrape one search term, all pages and retries",
+    "terms_total": "Search terms finished, by result",
+    "products_total": "Products extracted",
+    "products_normalized_total": "Products run through the normalization stage",
+    "products_deduplicated_total": "Duplicate products dropped by the normalization stage",
+    "tor_identity_changes_total": "Tor identity changes, by fetcher and result",
+    "tor_identity_change_seconds": "Time spent waiting for a Tor identity change",
+    "tor_circuit_wait_seconds": "Time spent waiting for a free circuit from the Tor pool",
+    "tor_circuit_rotations_total": "Pooled Tor circuits moved to a new exit after their health score dropped",
+    "throttle_concurrency_limit": "Requests the adaptive throttle currently allows in flight",
+    "throttle_rate_per_sec": "Request rate the adaptive throttle currently allows",
+    "throttle_block_rate": "Share of blocked pages in the adaptive throttle's recent window",
+}
+HISTOGRAM_BUCKETS = {"cards_found": COUNT_BUCKETS, "retry_delay_seconds": DELAY_BUCKETS}
+
+class MetricsRegistry:
+    # Process-wide counters, histograms and gauges, keyed by name and a sorted
+    # tuple of label pairs. Cheap enough to update from every fetch and parse.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def set_gauge(self, name, value, **labels):
+        # value may be a callable, read whenever the registry is exported, so
+        # state kept elsewhere (e.g. the throttle's) needs no per-request update.
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def _read_gauges(self):
+        with self._lock:
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+        return [(key, value() if callable(value) else value) for key, value in gauges]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._gauges.clear()
+
+    def counter_total(self, name, **labels):
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for (metric, label_pairs), value in self._counters.items()
+                       if metric == name and wanted <= set(label_pairs))
+
+    def block_rate(self):
+        pages = self.counter_total("page_outcomes_total")
+        return self.counter_total("page_outcomes_total", outcome="blocked") / pages if pages else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, dict(value, counts=list(value["counts"]))) for key, value in self._histograms.items()]
+
+        snapshot = {"timestamp": time.time(), "counters": {}, "histograms": {}, "gauges": {}}
+        for (name, label_pairs), value in sorted(counters):
+            snapshot["counters"].setdefault(name, []).append({"labels": dict(label_pairs), "value": value})
+        for (name, label_pairs), value in self._read_gauges():
+            snapshot["gauges"].setdefault(name, []).append({"labels": dict(label_pairs), "value": value})
+        for (name, label_pairs), histogram in sorted(histograms, key=lambda item: item[0]):
+            snapshot["histograms"].setdefault(name, []).append({
+                "labels": dict(label_pairs),
+                "count": histogram["count"],
+                "sum": round(histogram["sum"], 6),
+                "p50": _bucket_quantile(histogram, 0.50),
+                "p99": _bucket_quantile(histogram, 0.99),
+            })
+        snapshot["block_rate"] = round(self.block_rate(), 4)
+        return snapshot
+
+    def to_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(((key, dict(value, counts=list(value["counts"]))) for key, value in self._histograms.items()),
+                                key=lambda item: item[0])
+
+        lines = []
+        described = set()
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {METRIC_PREFIX}{name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+
+        for (name, label_pairs), value in counters:
+            header(name, "counter")
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(label_pairs)} {value}")
+        for (name, label_pairs), histogram in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(label_pairs + (('le', bound),))} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(label_pairs + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(label_pairs)} {histogram['sum']}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(label_pairs)} {histogram['count']}")
+        for (name, label_pairs), value in self._read_gauges():
+            header(name, "gauge")
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(label_pairs)} {value}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(label_pairs):
+    if not label_pairs:
+        return ""
+    escaped = (key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for key, value in label_pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def _bucket_quantile(histogram, fraction):
+    # Linear interpolation inside the bucket holding the quantile, as Prometheus' histogram_quantile does.
+    if not histogram["count"]:
+        return None
+    rank = fraction * histogram["count"]
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+        if count and cumulative + count >= rank:
+            return round(lower + (bound - lower) * (rank - cumulative) / count, 6)
+        cumulative += count
+        lower = bound
+    return histogram["buckets"][-1]
+
+METRICS = MetricsRegistry()
+
+def inc(name, value=1, **labels):
+    METRICS.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    METRICS.observe(name, value, **labels)
+
+def record_fetch(fetcher, started, response):
+    # started is a time.perf_counter() value taken before the request.
+    observe("fetch_seconds", time.perf_counter() - started, fetcher=fetcher)
+    if response is None:
+        inc("fetch_errors_total", fetcher=fetcher)
+        return
+    inc("fetch_responses_total", fetcher=fetcher, status=str(response.status_code))
+    size = getattr(response, "body_size", None)
+    if size is None:
+        content = getattr(response, "content", None)
+        size = len(content) if content else 0
+    if size:
+        inc("fetch_bytes_total", size, fetcher=fetcher)
+
+class PrometheusExporter:
+    # Serves the registry in the Prometheus text format on /metrics.
+    def __init__(self, port=9108, host="127.0.0.1", registry=METRICS):
+        self.registry = registry
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-exporter", daemon=True)
+        self._thread.start()
+
+    def _make_handler(self):
+        registry = self.registry
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return MetricsHandler
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+class JsonSnapshotWriter:
+    # Appends one snapshot per interval as a JSON line, plus a final one on close().
+    def __init__(self, path, interval=30.0, registry=METRICS):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="metrics-snapshots", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        line = json.dumps(self.registry.snapshot(), separators=(",", ":")) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.write_snapshot()
+
+# --- Quiet mode ---
+# Per-thread console output goes through console(). In quiet mode nothing is
+# printed; events are logged as one JSON object per line instead.
+QUIET = False
+logger = logging.getLogger("bing_scraper")
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            "thread": record.threadName,
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def set_quiet(quiet=True, level=logging.INFO, stream=None):
+    global QUIET
+    QUIET = quiet
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    if quiet:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonLogFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+def console(message, event=None, level=logging.INFO, **fields):
+    if not QUIET:
+        print(message)
+    elif event is not None:
+        logger.log(level, event, extra={"fields": fields})
@@ -0,0 +1,323 @@
+import base64
+import binascii
+import hashlib
+import math
+import re
+import threading
+import urllib.parse
+from metrics import inc
+
+# --- Prices ---
+# "$1,299.99", "From $359.00", "$163.00 - $211.90", "12,99 €", "US$ 15". The
+# integer part may use , . ' or (thin/no-break) spaces as thousands separators;
+# a trailing group of 1-2 digits after , or . is the decimal part.
+PRICE_NUMBER_RE = re.compile(r"(\d{1,3}(?:[,.'\u00a0\u202f ]\d{3})+|\d+)(?:[.,](\d{1,2}))?(?!\d)")
+# Currencies written with a decimal point: "$12.999" is 12.999, not 12999.
+DOT_DECIMAL_NUMBER_RE = re.compile(r"(\d{1,3}(?:[,'\u00a0\u202f ]\d{3})+|\d+)(?:\.(\d+))?(?!\d)")
+DOT_DECIMAL_CURRENCIES = frozenset(("USD", "CAD", "AUD", "NZD", "HKD", "GBP", "INR", "CHF"))
+THOUSANDS_SEPARATORS_RE = re.compile(r"[,.'\u00a0\u202f ]")
+PRICE_RANGE_SEPARATORS = frozenset(("-", "–", "—", "to"))
+PRICE_NOW_RE = re.compile(r"\bnow\b", re.IGNORECASE)
+PRICE_WAS_RE = re.compile(r"\bwas\b", re.IGNORECASE)
+CURRENCY_GAP = 2 # Max spaces between a currency and its amount
+CURRENCY_RE = re.compile(r"US\$|CA\$|AU\$|NZ\$|HK\$|C\$|A\$|R\$|[$€£¥₹₩₽]|\b(?:USD|EUR|GBP|CAD|AUD|JPY|INR|CHF)\b")
+CURRENCY_CODES = {
+    "$": "USD", "US$": "USD", "C$": "CAD", "CA$": "CAD", "A$": "AUD", "AU$": "AUD", "NZ$": "NZD",
+    "HK$": "HKD", "R$": "BRL", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR",
+    "₩": "KRW", "₽": "RUB",
+}
+
+def _currency_code(match):
+    return CURRENCY_CODES.get(match.group(0), match.group(0))
+
+def _adjacent_currency(text, number, currencies):
+    # Code of the currency written right before or after the amount, if any.
+    for currency in currencies:
+        if currency.end() <= number.start():
+            gap = text[currency.end():number.start()]
+        elif currency.start() >= number.end():
+            gap = text[number.end():currency.start()]
+        else:
+            continue
+        if len(gap) <= CURRENCY_GAP and not gap.strip():
+            return _currency_code(currency)
+    return None
+
+def _price_number(match):
+    whole, fraction = match.groups()
+    whole = THOUSANDS_SEPARATORS_RE.sub("", whole)
+    return float(whole + "." + fraction) if fraction else float(whole)
+
+def _amount(text, number, code):
+    if code in DOT_DECIMAL_CURRENCIES:
+        return _price_number(DOT_DECIMAL_NUMBER_RE.match(text, number.start()))
+    return _price_number(number)
+
+def parse_price(text):
+    # Returns (value, max_value, currency). max_value is only set for ranges;
+    # for "From $X" the value is the lower bound. Amounts next to a currency
+    # win over bare numbers ("2 for $10" is 10), and "Was $20 now $15" gives
+    # the current price. Unparseable prices give Nones.
+    if not text or text == "N/A":
+        return None, None, None
+    numbers = list(PRICE_NUMBER_RE.finditer(text))
+    if not numbers:
+        return None, None, None
+    currencies = list(CURRENCY_RE.finditer(text))
+    codes = [_adjacent_currency(text, number, currencies) for number in numbers]
+    priced = [i for i, code in enumerate(codes) if code] or list(range(len(numbers)))
+
+    index = priced[0]
+    now = PRICE_NOW_RE.search(text)
+    was_now = now is not None or PRICE_WAS_RE.search(text) is not None
+    if now:
+        after_now = [i for i in priced if numbers[i].start() >= now.end()]
+        index = after_now[0] if after_now else priced[-1]
+    elif was_now:
+        index = priced[-1]
+
+    code = codes[index] or (_currency_code(currencies[0]) if currencies else None)
+    value = _amount(text, numbers[index], code)
+    max_value = None
+    if not was_now and index + 1 < len(numbers):
+        between = CURRENCY_RE.sub("", text[numbers[index].end():numbers[index + 1].start()])
+        if between.strip().lower() in PRICE_RANGE_SEPARATORS:
+            max_value = _amount(text, numbers[index + 1], code)
+    return value, max_value, code
+
+# --- Links ---
+# Bing ad and shopping links are click-tracking redirects carrying the real
+# target in a query parameter, either URL-encoded or base64 ("a1" prefixed on
+# /ck/a links).
+REDIRECT_PARAMS = ("u", "url", "r")
+TRACKING_PARAMS = frozenset(("gclid", "msclkid", "fbclid", "dclid", "yclid", "mc_cid", "mc_eid", "_ga", "ref", "ref_"))
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+MISSING_LINK = "https://www.bing.com/N/A"
+
+def _decode_redirect_target(value):
+    if value.startswith(("http://", "https://")):
+        return value
+    if value.startswith("a1"):
+        value = value[2:]
+    try:
+        decoded = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return decoded if decoded.startswith(("http://", "https://")) else None
+
+def unwrap_redirect(link, max_depth=3):
+    # Follows redirect parameters on bing.com links; other links are returned as-is.
+    for _ in range(max_depth):
+        parts = urllib.parse.urlsplit(link)
+        host = parts.hostname or ""
+        if not (host == "bing.com" or host.endswith(".bing.com")) or not parts.query:
+            return link
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        target = None
+        for name in REDIRECT_PARAMS:
+            if params.get(name):
+                target = _decode_redirect_target(params[name])
+                if target:
+                    break
+        if not target:
+            return link
+        link = target
+    return link
+
+def canonical_link(link):
+    # Same listing, same string: unwrap redirects, lowercase scheme/host, drop
+    # default ports, tracking parameters, the fragment and the trailing slash,
+    # and sort the query.
+    link = (link or "").strip()
+    if not link:
+        return ""
+    parts = urllib.parse.urlsplit(unwrap_redirect(link))
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, _, port = netloc.rpartition(":")
+    if host and DEFAULT_PORTS.get(scheme) == port:
+        netloc = host
+    query = urllib.parse.urlencode(sorted(
+        (key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    ))
+    return urllib.parse.urlunsplit((scheme, netloc, parts.path.rstrip("/"), query, ""))
+
+def _has_link(link):
+    return bool(link) and link != "N/A" and link != MISSING_LINK
+
+def product_identity(product, link=None):
+    # Canonical link + store. Cards without a link all share the placeholder
+    # link, so the title (or, without one either, the price) stands in for it
+    # there. Pass link when the canonical form is already known.
+    if link is None:
+        link = product.get("link")
+        link = canonical_link(link) if _has_link(link) else None
+    if link:
+        identity = link
+    else:
+        title = (product.get("title") or "").strip().lower()
+        identity = "title:" + (title if title and title != "n/a" else "\x1f" + (product.get("price") or ""))
+    return identity + "\x1f" + (product.get("store") or "").strip().lower()
+
+def product_digest(product, link=None, scope=None):
+    # scope (e.g. the market) keeps otherwise identical products apart.
+    identity = product_identity(product, link)
+    if scope:
+        identity += "\x1f" + scope
+    return hashlib.blake2b(identity.encode("utf-8"), digest_size=16).digest()
+
+# --- Dedup ---
+class BloomFilter:
+    # Fixed-size bit array sized for `capacity` keys at `error_rate` false
+    # positives (10M keys at 0.1% is ~18 MB). Memory does not grow with the
+    # run; past capacity the false-positive rate climbs instead.
+    def __init__(self, capacity=10_000_000, error_rate=0.001):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("BloomFilter needs capacity > 0 and 0 < error_rate < 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, digest):
+        # digest is a 16-byte key hash; split into two 64-bit hashes for double hashing.
+        # Returns True if the key was (probably) present already.
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        bits = self._bits
+        num_bits = self.num_bits
+        present = True
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % num_bits
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    @property
+    def size_bytes(self):
+        return len(self._bits)
+
+class DigestSet:
+    # Exact dedup: a set of 64-bit key prefixes. Grows with the number of
+    # distinct products (~100 bytes each), so only for runs that fit in memory.
+    def __init__(self):
+        self._seen = set()
+
+    def add(self, digest):
+        key = int.from_bytes(digest[:8], "little")
+        if key in self._seen:
+            return True
+        self._seen.add(key)
+        return False
+
+    @property
+    def count(self):
+        return len(self._seen)
+
+def build_dedup(mode="bloom", capacity=10_000_000, error_rate=0.001):
+    if mode == "bloom":
+        return BloomFilter(capacity, error_rate)
+    if mode == "exact":
+        return DigestSet()
+    if mode is None:
+        return None
+    raise ValueError(f"Unknown dedup mode: {mode}")
+
+# --- Stage ---
+class ProductNormalizer:
+    # Normalizes one term's products in a batch: adds price_value, price_max
+    # and currency, replaces the link with its canonical form (keeping the
+    # original in bing_link when it was a redirect) and drops duplicates.
+    # With a run-wide dedup, duplicates are dropped across terms as well as
+    # within one; without it, only within the batch. Products from different
+    # markets (scope) are never duplicates of each other.
+    def __init__(self, dedup=None):
+        self.dedup = dedup
+        self._lock = threading.Lock()
+
+    def normalize_batch(self, products, scope=None):
+        normalized = []
+        digests = []
+        batch_seen = set()
+        for product in products:
+            product = dict(product)
+            product["price_value"], product["price_max"], product["currency"] = parse_price(product.get("price"))
+            link = product.get("link")
+            canonical = ""
+            if _has_link(link):
+                target = unwrap_redirect(link)
+                if target != link:
+                    product["bing_link"] = link
+                canonical = product["link"] = canonical_link(target)
+            digest = product_digest(product, canonical, scope)
+            if digest in batch_seen:
+                continue
+            batch_seen.add(digest)
+            normalized.append(product)
+            digests.append(digest)
+
+        if self.dedup is not None:
+            with self._lock:
+                normalized = [product for product, digest in zip(normalized, digests) if not self.dedup.add(digest)]
+        inc("products_normalized_total", len(products))
+        inc("products_deduplicated_total", len(products) - len(normalized))
+        return normalized
+
+class NormalizingSink:
+    # Output sink wrapper: normalizes each result's products before passing it on;
+    # a result left with no products after dedup is not written. The result is
+    # updated in place, so the caller reports the products actually written.
+    def __init__(self, normalizer, inner_sink):
+        self.normalizer = normalizer
+        self.inner_sink = inner_sink
+
+    def location_for(self, result):
+        return self.inner_sink.location_for(result)
+
+    def write(self, result):
+        products = self.normalizer.normalize_batch(result.get("products") or [], scope=result.get("market"))
+        duplicates = result["product_count"] - len(products)
+        result.update(product_count=len(products), duplicates_dropped=duplicates, products=products)
+        if not products:
+            return None
+        return self.inner_sink.write(result)
+
+    def after_flush(self, callback):
+        self.inner_sink.after_flush(callback)
+
+    def close(self):
+        self.inner_sink.close()
+
+def self_check():
+    # Price parsing on the formats seen on result cards.
+    cases = {
+        "$1,299.99": (1299.99, None, "USD"),
+        "From $359.00": (359.0, None, "USD"),
+        "$163.00 - $211.90": (163.0, 211.9, "USD"),
+        "$10 to 20": (10.0, 20.0, "USD"),
+        "12,99 €": (12.99, None, "EUR"),
+        "1.299,00 €": (1299.0, None, "EUR"),
+        "US$ 15": (15.0, None, "USD"),
+        "2 for $10": (10.0, None, "USD"),
+        "Was $20 now $15": (15.0, None, "USD"),
+        "Now $15, was $20": (15.0, None, "USD"),
+        "$12.999": (12.999, None, "USD"),
+        "CHF 1'299.90": (1299.9, None, "CHF"),
+        "1299": (1299.0, None, None),
+        "N/A": (None, None, None),
+    }
+    for text, expected in cases.items():
+        parsed = parse_price(text)
+        if parsed != expected:
+            raise AssertionError(f"parse_price({text!r}) gave {parsed}, expected {expected}")
+
+if __name__ == "__main__":
+    self_check()
+    print("normalize self-check passed.")
@@ -0,0 +1,289 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+from colorama import Fore
+from extractor import CardExtractor
+from metrics import console, inc, observe
+from rate_limit import OUTCOME_BLOCKED, OUTCOME_EMPTY, OUTCOME_ERROR, OUTCOME_OK, RetryQueue
+from scraper_classes import BingShopScraper, classify_outcome, looks_blocked
+
+# One extractor per parse process, built on first use.
+_PROCESS_EXTRACTORS = {}
+
+def parse_page(content, base_url, engine):
+    # Runs in a worker process. Returns (products, cards_found, blocked, parse_seconds);
+    # the parent records the metrics since the registry is per process.
+    started = time.perf_counter()
+    extractor = _PROCESS_EXTRACTORS.get(engine)
+    if extractor is None:
+        extractor = _PROCESS_EXTRACTORS[engine] = CardExtractor(engine)
+    products, cards_found = extractor.extract(content, base_url)
+    blocked = False
+    if not products:
+        text = content.decode("utf-8", errors="replace") if isinstance(content, bytes) else content
+        blocked = looks_blocked(text)
+    return products, cards_found, blocked, time.perf_counter() - started
+
+class ParsePipeline:
+    # Fetch threads only download raw page bytes; parsing runs in a process
+    # pool so it is not serialized by the GIL. Both hand-offs are bounded:
+    # the term queue holds at most fetch_queue_depth terms and at most
+    # parse_queue_depth pages wait for (or are in) the parse pool, so a slow
+    # parse stage blocks the fetchers instead of piling up HTML in memory.
+    # Failed terms wait out their backoff in retry_queue, not in a fetch thread.
+    # Once a term's first page has products, its pages 2..max_pages are queued
+    # for the fetch threads ahead of new terms, all at once, and merged like
+    # scrape() merges them when the last one is parsed.
+    def __init__(self, make_fetcher, fetch_workers=3, parse_workers=None,
+                 fetch_queue_depth=100, parse_queue_depth=None, engine="lxml",
+                 page_retry_attempts=15, output_sink=None, on_result=None, release_fetcher=None,
+                 throttle=None, retry_queue=None, max_pages=1):
+        self.make_fetcher = make_fetcher
+        self.release_fetcher = release_fetcher
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.fetch_queue_depth = fetch_queue_depth
+        self.parse_queue_depth = parse_queue_depth or self.parse_workers * 4
+        self.engine = engine
+        self.page_retry_attempts = page_retry_attempts
+        self.max_pages = max(1, max_pages)
+        self.output_sink = output_sink
+        self.throttle = throttle
+        self.on_result = on_result
+
+        self._term_queue = queue.Queue(maxsize=fetch_queue_depth)
+        self._page_queue = queue.Queue() # Follow-up pages of terms in flight: (TermPages, index)
+        self._retry_queue = retry_queue if retry_queue is not None else RetryQueue()
+        self._parse_slots = threading.BoundedSemaphore(self.parse_queue_depth)
+        self._outstanding = 0
+        self._outstanding_lock = threading.Condition()
+        self._done_event = threading.Event()
+        self._executor = None
+
+    def run(self, search_terms):
+        self._done_event.clear()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_workers) as executor:
+            self._executor = executor
+            fetch_threads = [
+                threading.Thread(target=self._fetch_loop, name=f"fetch-{i}", daemon=True)
+                for i in range(self.fetch_workers)
+            ]
+            for thread in fetch_threads:
+                thread.start()
+
+            for term in search_terms:
+                with self._outstanding_lock:
+                    self._outstanding += 1
+                self._term_queue.put((term, 0))
+
+            with self._outstanding_lock:
+                while self._outstanding:
+                    self._outstanding_lock.wait()
+            self._done_event.set()
+            for thread in fetch_threads:
+                thread.join()
+        self._executor = None
+
+    def _next_job(self):
+        try:
+            return self._page_queue.get_nowait()
+        except queue.Empty:
+            pass
+        due = self._retry_queue.pop_due(1)
+        if due:
+            return due[0]
+        try:
+            return self._term_queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def _fetch_loop(self):
+        fetcher_instance = self.make_fetcher()
+        try:
+            while not self._done_event.is_set():
+                job = self._next_job()
+                if job is None:
+                    continue
+                if isinstance(job[0], TermPages):
+                    self._fetch_follow_up(fetcher_instance, *job)
+                    continue
+                term, retry_attempt = job
+                scraper = BingShopScraper(
+                    search_term=term,
+                    fetcher_instance=fetcher_instance,
+                    page_retry_attempts=self.page_retry_attempts,
+                    output_sink=self.output_sink,
+                    max_pages=self.max_pages,
+                    throttle=self.throttle,
+                    requeue=True
+                )
+                try:
+                    self._fetch_term(scraper, retry_attempt)
+                except Exception as e:
+                    console(Fore.RED + f"[{term}] Error during fetch: {e}", "fetch_error", logging.ERROR, term=term, error=str(e))
+                    self._finish(scraper, [])
+        finally:
+            if self.release_fetcher:
+                self.release_fetcher(fetcher_instance)
+
+    def _get(self, fetcher_instance, target_url):
+        # Returns (response, fetch_seconds); fetch_seconds is None for a cached page.
+        if self.throttle:
+            self.throttle.acquire()
+        try:
+            started = time.perf_counter()
+            response = fetcher_instance.get(target_url)
+            fetch_seconds = time.perf_counter() - started
+        finally:
+            if self.throttle:
+                self.throttle.release()
+        return response, None if getattr(response, 'from_cache', False) else fetch_seconds
+
+    def _record_outcome(self, scraper, fetcher_instance, outcome, fetch_seconds):
+        inc("page_outcomes_total", outcome=outcome)
+        if self.throttle:
+            self.throttle.record(outcome)
+        if fetch_seconds is not None:
+            scraper.record_fetcher_outcome(None, outcome, fetch_seconds, fetcher_instance)
+
+    def _submit_parse(self, response, base_url, callback):
+        content = response.content
+        self._parse_slots.acquire()
+        try:
+            future = self._executor.submit(parse_page, content, base_url, self.engine)
+        except Exception:
+            self._parse_slots.release()
+            raise
+        future.add_done_callback(callback)
+
+    def _parsed_outcome(self, future, scraper, target_url, fetcher_instance, fetch_seconds):
+        # Runs as a parse future's callback. Returns (products, cards_found, outcome),
+        # or None when parsing failed.
+        self._parse_slots.release()
+        try:
+            products, cards_found, blocked, parse_seconds = future.result()
+        except Exception as e:
+            console(Fore.RED + f"[{scraper.search_term}] Error during parsing: {e}",
+                    "parse_error", logging.ERROR, term=scraper.search_term, error=str(e))
+            return None
+        observe("parse_seconds", parse_seconds)
+        observe("cards_found", cards_found)
+        outcome = OUTCOME_OK if products else OUTCOME_BLOCKED if blocked else OUTCOME_EMPTY
+        self._record_outcome(scraper, fetcher_instance, outcome, fetch_seconds)
+        if not cards_found:
+            console(Fore.YELLOW + f"[{scraper.search_term}] No product card containers found using common selectors on page ({target_url}).",
+                    "no_cards", logging.WARNING, term=scraper.search_term, url=target_url)
+        return products, cards_found, outcome
+
+    def _fetch_term(self, scraper, retry_attempt):
+        if retry_attempt > 0 and not scraper._prepare_retry(retry_attempt, wait=False):
+            self._finish(scraper, [])
+            return
+        scraper.partial = retry_attempt > 0
+
+        target_url = scraper.build_url()
+        response, fetch_seconds = self._get(scraper.fetcher, target_url)
+        if not scraper._validate_response(response, target_url):
+            # Same classification as scrape(): an empty 200 body is empty, not an error.
+            outcome = classify_outcome(response, [])
+            self._record_outcome(scraper, scraper.fetcher, outcome, fetch_seconds)
+            if response is not None and response.status_code == 404:
+                self._finish(scraper, [])
+            else:
+                last_content = getattr(scraper.fetcher, 'last_response_content', None)
+                self._retry_or_finish(scraper, last_content, retry_attempt)
+            return
+
+        fetcher_instance = scraper.fetcher
+        self._submit_parse(response, scraper.base_url, lambda f: self._on_parsed(
+            f, scraper, target_url, retry_attempt, fetcher_instance, fetch_seconds))
+
+    def _on_parsed(self, future, scraper, target_url, retry_attempt, fetcher_instance, fetch_seconds):
+        parsed = self._parsed_outcome(future, scraper, target_url, fetcher_instance, fetch_seconds)
+        if parsed is None:
+            self._finish(scraper, [])
+            return
+        products, _, outcome = parsed
+        if products:
+            offsets = scraper.page_offsets(products) if self.max_pages > 1 else []
+            if not offsets:
+                self._finish(scraper, products)
+                return
+            pages = TermPages(scraper, products, offsets)
+            for index in range(len(offsets)):
+                self._page_queue.put((pages, index))
+            return
+        # Same retry decision scrape() makes, without re-sending the page text back.
+        self._retry_or_finish(scraper, None, retry_attempt, blocked=outcome == OUTCOME_BLOCKED)
+
+    def _fetch_follow_up(self, fetcher_instance, pages, index):
+        scraper = pages.scraper
+        target_url = scraper.build_url(pages.offsets[index])
+        try:
+            response, fetch_seconds = self._get(fetcher_instance, target_url)
+            if not scraper._validate_response(response, target_url):
+                outcome = classify_outcome(response, [])
+                self._record_outcome(scraper, fetcher_instance, outcome, fetch_seconds)
+                self._follow_up_done(pages, index, [], outcome)
+                return
+            self._submit_parse(response, scraper.base_url, lambda f: self._on_follow_up_parsed(
+                f, pages, index, target_url, fetcher_instance, fetch_seconds))
+        except Exception as e:
+            console(Fore.RED + f"[{scraper.search_term}] Error during fetch: {e}", "fetch_error", logging.ERROR,
+                    term=scraper.search_term, url=target_url, error=str(e))
+            self._follow_up_done(pages, index, [], OUTCOME_ERROR)
+
+    def _on_follow_up_parsed(self, future, pages, index, target_url, fetcher_instance, fetch_seconds):
+        parsed = self._parsed_outcome(future, pages.scraper, target_url, fetcher_instance, fetch_seconds)
+        products, _, outcome = parsed if parsed is not None else ([], 0, OUTCOME_ERROR)
+        self._follow_up_done(pages, index, products, outcome)
+
+    def _follow_up_done(self, pages, index, products, outcome):
+        scraper = pages.scraper
+        if outcome in (OUTCOME_BLOCKED, OUTCOME_ERROR):
+            scraper.partial = True
+        if pages.page_done(index, products, outcome):
+            scraper._merge_pages(pages.products, pages.results)
+            self._finish(scraper, pages.products)
+
+    def _retry_or_finish(self, scraper, last_content, retry_attempt, blocked=None):
+        if scraper._handle_failed_attempt(last_content, retry_attempt, blocked=blocked):
+            scraper._request_new_identity()
+            delay = self._retry_queue.push(scraper.search_term, retry_attempt + 1)
+            inc("retries_scheduled_total")
+            observe("retry_delay_seconds", delay)
+        else:
+            self._finish(scraper, [])
+
+    def _finish(self, scraper, products):
+        try:
+            result = scraper._build_result(products)
+            if self.on_result:
+                self.on_result(scraper.search_term, result)
+        except Exception as e:
+            console(Fore.RED + f"[{scraper.search_term}] Error while saving result: {e}",
+                    "save_error", logging.ERROR, term=scraper.search_term, error=str(e))
+        finally:
+            with self._outstanding_lock:
+                self._outstanding -= 1
+                self._outstanding_lock.notify_all()
+
+class TermPages:
+    # A term whose first page had products, waiting for its follow-up pages.
+    def __init__(self, scraper, products, offsets):
+        self.scraper = scraper
+        self.products = products
+        self.offsets = offsets
+        self.results = [None] * len(offsets) # (products, outcome) per offset
+        self._remaining = len(offsets)
+        self._lock = threading.Lock()
+
+    def page_done(self, index, products, outcome):
+        # True for the call that completes the last page.
+        with self._lock:
+            self.results[index] = (products, outcome)
+            self._remaining -= 1
+            return not self._remaining
@@ -0,0 +1,203 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import random
+import threading
+import time
+
+OUTCOME_OK = "ok"
+OUTCOME_EMPTY = "empty"
+OUTCOME_BLOCKED = "blocked"
+OUTCOME_ERROR = "error"
+
+class TokenBucket:
+    # Thread-safe token bucket. reserve() never blocks: it takes a token (possibly
+    # going into debt) and returns how long the caller must wait before using it,
+    # so the same bucket works for threads and for asyncio.
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill_locked(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            self.rate = float(rate)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            return self._tokens
+
+class AdaptiveThrottle:
+    # Shared by all workers of a run. A token bucket caps the request rate and an
+    # AIMD controller caps how many requests are in flight: every
+    # `increase_every` clean responses add one slot (and `rate_step` req/s),
+    # a block/CAPTCHA response halves both (at most once per `cooldown` seconds),
+    # down to min_rate (rate / 8 unless given).
+    def __init__(self, rate=2.0, max_rate=None, burst=None, initial_concurrency=2, min_concurrency=1,
+                 max_concurrency=16, increase_every=10, decrease_factor=0.5, rate_step=0.25,
+                 cooldown=5.0, window=200, min_rate=None):
+        self.max_rate = max_rate if max_rate is not None else rate * 4
+        self.min_rate = min(rate, min_rate if min_rate is not None else rate / 8)
+        self.rate_step = rate_step
+        self.bucket = TokenBucket(rate, burst)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase_every = increase_every
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.limit = max(min_concurrency, min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self._clean_streak = 0
+        self._last_decrease = 0.0
+        self._recent = collections.deque(maxlen=window)
+        self._counts = collections.Counter()
+        self._increases = 0
+        self._decreases = 0
+        self._cond = threading.Condition()
+
+    def _try_take_slot(self):
+        with self._cond:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        self.bucket.acquire()
+
+    async def acquire_async(self):
+        while not self._try_take_slot():
+            await asyncio.sleep(0.05)
+        await self.bucket.acquire_async()
+
+    def release(self, outcome=None):
+        # outcome may be left out and reported later with record().
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if outcome is not None:
+                self._record_locked(outcome)
+            self._cond.notify_all()
+
+    def record(self, outcome):
+        with self._cond:
+            self._record_locked(outcome)
+            self._cond.notify_all()
+
+    def _record_locked(self, outcome):
+        self._counts[outcome] += 1
+        self._recent.append(outcome)
+        if outcome == OUTCOME_BLOCKED:
+            self._clean_streak = 0
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self._decreases += 1
+                self.limit = max(self.min_concurrency, int(self.limit * self.decrease_factor))
+                self.bucket.set_rate(max(self.min_rate, self.bucket.rate * self.decrease_factor))
+        elif outcome == OUTCOME_OK:
+            self._clean_streak += 1
+            if self._clean_streak >= self.increase_every:
+                self._clean_streak = 0
+                self._increases += 1
+                self.limit = min(self.max_concurrency, self.limit + 1)
+                self.bucket.set_rate(min(self.max_rate, self.bucket.rate + self.rate_step))
+
+    def block_rate(self):
+        with self._cond:
+            if not self._recent:
+                return 0.0
+            return sum(1 for outcome in self._recent if outcome == OUTCOME_BLOCKED) / len(self._recent)
+
+    def metrics(self):
+        block_rate = self.block_rate()
+        with self._cond:
+            return {
+                "concurrency_limit": self.limit,
+                "in_flight": self.in_flight,
+                "rate_per_sec": round(self.bucket.rate, 3),
+                "tokens": round(self.bucket.tokens, 3),
+                "block_rate": round(block_rate, 4),
+                "increases": self._increases,
+                "decreases": self._decreases,
+                "outcomes": dict(self._counts),
+            }
+
+class RetryQueue:
+    # Failed work waiting for another attempt, ordered by when it is due, so no
+    # worker has to sleep through the backoff. The delay doubles with each
+    # attempt (base_delay, 2x, 4x ... capped at max_delay); `jitter` is the part
+    # of it that is random, so terms that failed together do not all come back
+    # at the same moment.
+    def __init__(self, base_delay=5.0, max_delay=300.0, jitter=0.5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def delay_for(self, attempt):
+        # attempt is the retry about to be scheduled: 1 for the first retry.
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, attempt - 1))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    def push(self, item, attempt):
+        delay = self.delay_for(attempt)
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), item, attempt))
+        return delay
+
+    def pop_due(self, limit=None):
+        # Returns [(item, attempt), ...] for everything whose delay has passed.
+        due = []
+        now = time.monotonic()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                _, _, item, attempt = heapq.heappop(self._heap)
+                due.append((item, attempt))
+        return due
+
+    def next_due_in(self):
+        # Seconds until the next item is due (0 if one already is), None when empty.
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
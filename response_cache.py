@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+from colorama import Fore
+from metrics import console
+from scraper_classes import FetchResponse, looks_blocked
+
+def normalize_url(url):
+    # Same page, same key: lowercase scheme/host, drop the fragment and sort the query.
+    parts = urllib.parse.urlsplit(url.strip())
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+def cache_key(url):
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+class CachedResponse:
+    def __init__(self, url, status_code, body, fetched_at):
+        self.url = url
+        self.status_code = status_code
+        self.body = body
+        self.fetched_at = fetched_at
+
+class ResponseCache:
+    # On-disk cache of response bodies keyed by normalized URL. Bodies are
+    # zlib-compressed files named after the key; a small SQLite index tracks
+    # status, fetch time, size and last access for TTL and LRU eviction.
+    def __init__(self, cache_dir=".cache/responses", ttl=24 * 3600, max_bytes=1024 * 1024 * 1024, compression_level=6):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL,"
+            " fetched_at REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".z")
+
+    def get(self, url, allow_expired=False):
+        key = cache_key(url)
+        with self._lock:
+            row = self._db.execute("SELECT url, status, fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not allow_expired and self.ttl is not None and time.time() - row[2] > self.ttl:
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        try:
+            with open(self._path_for(key), "rb") as f:
+                body = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            self.delete(url)
+            return None
+        return CachedResponse(row[0], row[1], body, row[2])
+
+    def put(self, url, status_code, body):
+        key = cache_key(url)
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(body, self.compression_level)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, url, status, fetched_at, last_access, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, normalize_url(url), status_code, now, now, len(data))
+            )
+            self._total_bytes += len(data) - (old[0] if old else 0)
+            self._evict_locked()
+            self._db.commit()
+
+    def delete(self, url):
+        key = cache_key(url)
+        with self._lock:
+            self._delete_locked(key)
+            self._db.commit()
+
+    def _delete_locked(self, key):
+        row = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._total_bytes -= row[0]
+        try:
+            os.remove(self._path_for(key))
+        except OSError:
+            pass
+
+    def _evict_locked(self):
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes:
+            return
+        # Least recently used first, down to 90% of the cap so we don't evict on every put.
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if self._total_bytes <= target:
+                break
+            self._delete_locked(key)
+
+    def purge_expired(self):
+        if self.ttl is None:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            keys = [row[0] for row in self._db.execute("SELECT key FROM entries WHERE fetched_at < ?", (cutoff,))]
+            for key in keys:
+                self._delete_locked(key)
+            self._db.commit()
+        return len(keys)
+
+    def urls(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT url FROM entries ORDER BY fetched_at")]
+
+    def stats(self):
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": count, "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class CachingFetcher:
+    # Wraps any fetcher with the RequestsFetcher get() contract. With offline=True
+    # it never touches the network, so pages can be re-parsed from cache after
+    # selector changes. refresh=True skips cache reads (responses are still
+    # stored): a retried term must not be served the cached page that failed it.
+    def __init__(self, inner_fetcher, cache, offline=False, cacheable_statuses=(200,), refresh=False):
+        self.inner_fetcher = inner_fetcher
+        self.cache = cache
+        self.offline = offline
+        self.refresh = refresh
+        self.cacheable_statuses = cacheable_statuses
+        self.last_response_content = None
+        self.is_tor_fetcher = getattr(inner_fetcher, 'is_tor_fetcher', False)
+        self._last_hit_url = None
+
+    def __getattr__(self, name):
+        return getattr(self.inner_fetcher, name)
+
+    def change_tor_identity(self):
+        return self.inner_fetcher.change_tor_identity()
+
+    def get(self, url, **kwargs):
+        self.last_response_content = None
+        # A second request for the page we just served from cache is a retry:
+        # go to the network instead of replaying the same body.
+        if self.offline or (not self.refresh and url != self._last_hit_url):
+            cached = self.cache.get(url)
+            if cached is not None:
+                self._last_hit_url = url
+                response = FetchResponse(cached.status_code, url=url, content=cached.body)
+                response.from_cache = True
+                self.last_response_content = response.text
+                return response
+        self._last_hit_url = None
+        if self.offline:
+            console(Fore.YELLOW + f"Cache miss in offline mode: {url}", "cache_miss_offline", logging.WARNING, url=url)
+            return None
+
+        response = self.inner_fetcher.get(url, **kwargs)
+        self.last_response_content = getattr(self.inner_fetcher, 'last_response_content', None)
+        if response is not None and response.status_code in self.cacheable_statuses and response.content \
+           and not looks_blocked(self.last_response_content):
+            try:
+                self.cache.put(url, response.status_code, response.content)
+            except (OSError, sqlite3.Error) as e:
+                console(Fore.RED + f"Failed to cache response for {url}: {e}", "cache_write_error", logging.ERROR,
+                        url=url, error=str(e))
+        return response
@@ -1,11 +1,15 @@
-import json
+import asyncio
+import concurrent.futures
+import logging
+import re
 import time
 import urllib.parse
-import os
-import requests
-from bs4 import BeautifulSoup
 from colorama import Fore, Style
-import re # For regex in selectors
+from extractor import CardExtractor
+from sinks import JsonFileSink
+from rate_limit import OUTCOME_BLOCKED, OUTCOME_EMPTY, OUTCOME_ERROR, OUTCOME_OK
+from metrics import console, inc, observe, record_fetch
+from streaming import BLOCK_STATUS_CODES, FetchResponse, STREAM_CHUNK_SIZE, streamed_fetch_response
 
 # HTTP Headers:
 DEFAULT_HEADERS_BING = {
@@ -21,12 +25,36 @@ DEFAULT_HEADERS_BING = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0"
 }
 
+BING_SHOP_URL = "https://www.bing.com/shop" # Pointed at bench/mock_bing.py by the benchmarks
+
+BLOCK_SIGNATURE_RE = re.compile(r"captcha|access denied|blocked|unable to process request", re.I)
+
+def looks_blocked(content):
+    if not content or not isinstance(content, str):
+        return False
+    return BLOCK_SIGNATURE_RE.search(content) is not None
+
+def classify_outcome(response, products):
+    # Outcome of one page fetch, as reported to the AdaptiveThrottle.
+    if products:
+        return OUTCOME_OK
+    if response is None:
+        return OUTCOME_ERROR
+    if response.status_code in BLOCK_STATUS_CODES or looks_blocked(response.text):
+        return OUTCOME_BLOCKED
+    return OUTCOME_EMPTY
+
 class RequestsFetcher:
-    def __init__(self):
+    def __init__(self, streaming=True, custom_headers=None):
+        import requests
         self.session = requests.Session()
         self.session.headers.update(DEFAULT_HEADERS_BING)
+        if custom_headers:
+            self.session.headers.update(custom_headers)
+        self._http_error = requests.exceptions.HTTPError
         self.last_response_content = None
         self.is_tor_fetcher = False
+        self.streaming = streaming
 
     def change_tor_identity(self):
         return True
@@ -42,191 +70,312 @@ class RequestsFetcher:
 
     def get(self, url, **kwargs):
         self.last_response_content = None
+        started = time.perf_counter()
+        response = None
         try:
             timeout = kwargs.pop('timeout', 20)
+            if self.streaming:
+                with self.session.get(url, timeout=timeout, stream=True, **kwargs) as raw_response:
+                    response = streamed_fetch_response(raw_response, raw_response.iter_content(STREAM_CHUNK_SIZE))
+                self.last_response_content = response.text
+                return response
             response = self.session.get(url, timeout=timeout, **kwargs)
             self.last_response_content = response.text
             response.raise_for_status()
             return response
-        except requests.exceptions.HTTPError as e:
-            if e.response is not None:
-                return e.response
-            return None
+        except self._http_error as e:
+            response = e.response
+            return response
         except Exception:
+            response = None
             return None
+        finally:
+            record_fetch("requests", started, response)
+
+DEFAULT_EXTRACTOR = CardExtractor()
 
 class BingShopScraper:
-    def __init__(self, search_term, fetcher_instance=None, page_retry_attempts=3):
+    def __init__(self, search_term, fetcher_instance=None, page_retry_attempts=3, extractor=None, output_sink=None,
+                 max_pages=1, page_concurrency=3, throttle=None, market=None, first_attempt=0, requeue=False):
         self.search_term = search_term.strip()
         self.fetcher = fetcher_instance if fetcher_instance else RequestsFetcher()
+        self.extractor = extractor if extractor else DEFAULT_EXTRACTOR
         self.page_retry_attempts = page_retry_attempts
+        self.max_pages = max(1, max_pages)
+        self.page_concurrency = max(1, page_concurrency)
+        self.throttle = throttle
+        self.market = market # markets.Market; None is the original cc=us search
+        # requeue=True: scrape() makes one attempt (number first_attempt) and, if
+        # it failed but may be retried, returns the next attempt number in the
+        # result ("retry_attempt") for the caller to schedule.
+        self.first_attempt = first_attempt
+        self.requeue = requeue
+        # Set when the scrape needed retries or a page failed (blocked or errored):
+        # the products found may not be all there are.
+        self.partial = False
         self.base_url = "https://www.bing.com"
-        self.shop_url_base = "https://www.bing.com/shop"
+        self.shop_url_base = BING_SHOP_URL
         self.is_using_tor_fetcher = getattr(self.fetcher, 'is_tor_fetcher', False)
+        self.last_page_content = None
+        self.output_sink = output_sink if output_sink else JsonFileSink()
+
+    def build_url(self, first=1):
+        if self.market is None:
+            return f"{self.shop_url_base}?q={urllib.parse.quote_plus(self.search_term)}&cc=us&first={first}"
+        market_params = urllib.parse.urlencode(self.market.url_params())
+        return f"{self.shop_url_base}?q={urllib.parse.quote_plus(self.search_term)}&{market_params}&first={first}"
 
-        if not os.path.exists("out"):
-            os.makedirs("out")
+    def page_offsets(self, first_page_products):
+        # Bing's `first` is a 1-based result offset; page 1 tells us the page size.
+        page_size = len({p["link"] for p in first_page_products}) or len(first_page_products)
+        return [1 + page_index * page_size for page_index in range(1, self.max_pages)]
 
-    def build_url(self):
-        return f"{self.shop_url_base}?q={urllib.parse.quote_plus(self.search_term)}&cc=us&first=1"
+    def _merge_pages(self, all_products_data, pages):
+        # pages are (products, outcome) in offset order. A clean empty or
+        # all-duplicate page is the end of the results; a blocked or errored page
+        # is skipped and the pages after it are still merged.
+        seen_links = {p["link"] for p in all_products_data}
+        for page_data, outcome in pages:
+            if outcome in (OUTCOME_BLOCKED, OUTCOME_ERROR):
+                continue
+            new_products = [p for p in page_data if p["link"] not in seen_links]
+            if not new_products:
+                return False
+            for product in new_products:
+                seen_links.add(product["link"])
+            all_products_data.extend(new_products)
+        return True
 
     def _attempt_ip_change_if_tor(self):
         if not self.is_using_tor_fetcher:
             return True
         return self.fetcher.change_tor_identity()
 
-    def extract_product_info_from_page(self):
-        target_url = self.build_url()
+    def extract_product_info_from_page(self, first=1):
+        return self.fetch_page(first)[0]
+
+    def fetch_page(self, first=1):
+        # Returns (products, outcome); see classify_outcome.
+        target_url = self.build_url(first)
+        if self.throttle:
+            self.throttle.acquire()
+        response = None
         products_on_page = []
+        fetch_seconds = None
+        try:
+            started = time.perf_counter()
+            response = self.fetcher.get(target_url)
+            fetch_seconds = time.perf_counter() - started
+            products_on_page = self._parse_response(response, target_url)
+        finally:
+            outcome = classify_outcome(response, products_on_page)
+            inc("page_outcomes_total", outcome=outcome)
+            if self.throttle:
+                self.throttle.release(outcome)
+            self.record_fetcher_outcome(response, outcome, fetch_seconds)
+            if outcome in (OUTCOME_BLOCKED, OUTCOME_ERROR):
+                self.partial = True
+        return products_on_page, outcome
 
-        response = self.fetcher.get(target_url)
+    def record_fetcher_outcome(self, response, outcome, fetch_seconds, fetcher_instance=None):
+        # Feeds the health score of pooled Tor circuits (TorCircuit.record_outcome);
+        # a page served from the response cache says nothing about the circuit.
+        record_outcome = getattr(fetcher_instance or self.fetcher, 'record_outcome', None)
+        if record_outcome is not None and not getattr(response, 'from_cache', False):
+            record_outcome(outcome, fetch_seconds)
 
+    async def extract_product_info_from_page_async(self, first=1):
+        return (await self.fetch_page_async(first))[0]
+
+    async def fetch_page_async(self, first=1):
+        target_url = self.build_url(first)
+        if self.throttle:
+            await self.throttle.acquire_async()
+        response = None
+        products_on_page = []
+        try:
+            response = await self.fetcher.get(target_url)
+            self.last_page_content = response.text if response is not None else None
+            products_on_page = self._parse_response(response, target_url)
+        finally:
+            outcome = classify_outcome(response, products_on_page)
+            inc("page_outcomes_total", outcome=outcome)
+            if self.throttle:
+                self.throttle.release(outcome)
+            if outcome in (OUTCOME_BLOCKED, OUTCOME_ERROR):
+                self.partial = True
+        return products_on_page, outcome
+
+    def _validate_response(self, response, target_url):
         if not response:
-            print(Fore.RED + f"[{self.search_term}] No response object for search term ({target_url}).")
-            return products_on_page
+            console(Fore.RED + f"[{self.search_term}] No response object for search term ({target_url}).",
+                    "no_response", logging.WARNING, term=self.search_term, url=target_url)
+            return False
         if not response.text:
-            print(Fore.RED + f"[{self.search_term}] Empty response content for search term ({target_url}). Status: {response.status_code if hasattr(response, 'status_code') else 'N/A'}")
-            return products_on_page
+            status = response.status_code if hasattr(response, 'status_code') else 'N/A'
+            console(Fore.RED + f"[{self.search_term}] Empty response content for search term ({target_url}). Status: {status}",
+                    "empty_response", logging.WARNING, term=self.search_term, url=target_url, status=status)
+            return False
         if response.status_code == 404:
-            print(Fore.RED + f"[{self.search_term}] Page for search term returned 404. Skipping.")
-            return products_on_page
-
-        soup = BeautifulSoup(response.text, "lxml")
-
-        product_card_selectors = [
-            "li.GridItem", "div.br-resultsItemObsRV", "div.sh-dlr__list-result",
-            "div.sh-dgr__grprod", "div.br-card", "div.Card", "div.algocore",
-            "div.product-item", "div[data-hveid]", "div[data-listing-id]"
-        ]
-        
-        product_cards = []
-        for selector in product_card_selectors:
-            found_cards = soup.select(selector)
-            if found_cards:
-                product_cards.extend(found_cards)
-        
-        unique_product_cards = list(dict.fromkeys(product_cards))
-
-        if not unique_product_cards:
-            print(Fore.YELLOW + f"[{self.search_term}] No product card containers found using common selectors on page ({target_url}).")
-            return products_on_page
-
-        for card in unique_product_cards:
-            # Removed "image_url" from here
-            product_data = {
-                "title": "N/A", "price": "N/A", "link": "N/A",
-                "store": "N/A"
-            }
-
-            title_container = card.find('div', class_=lambda c: c and 'br-title' in c.split() and 'br-freeGridFontChange' in c.split())
-            if title_container:
-                title_span = title_container.find('span', title=True)
-                if title_span:
-                    product_data["title"] = title_span.get_text(strip=True)
-                else:
-                    product_data["title"] = title_container.get_text(strip=True)
-            
-            price_outer_container = card.find('div', class_=lambda c: c and 'pd-price' in c.split())
-            if price_outer_container:
-                price_inner_div = price_outer_container.find('div', class_='resp-one-line')
-                if price_inner_div:
-                    product_data["price"] = price_inner_div.get_text(strip=True)
-                else:
-                    product_data["price"] = price_outer_container.get_text(strip=True)
-            
-            link_tag = None
-            if card.name == 'a' and card.has_attr('href'):
-                link_tag = card
-            else:
-                if title_container and title_container.find_parent('a', href=True):
-                    link_tag = title_container.find_parent('a', href=True)
-                elif card.find('h3') and card.find('h3').find_parent('a', href=True):
-                     link_tag = card.find('h3').find_parent('a', href=True)
-                if not link_tag:
-                    link_tag = card.find('a', href=True)
-            
-            if link_tag and link_tag.has_attr('href'):
-                product_data["link"] = link_tag['href']
-
-            # Image URL Extraction Logic REMOVED
-            # image_tag = card.find('img', class_=re.compile(r'(img|image|thumb)', re.I))
-            # if image_tag:
-            #     product_data["image_url"] = image_tag.get('src') or image_tag.get('data-src')
-
-            # Store Name Extraction
-            product_data["store"] = "N/A" 
-            store_seller_name_div = card.find('div', class_=lambda c: c and 'br-sellerName' in c.split())
-            if store_seller_name_div:
-                actual_seller_div = store_seller_name_div.find('div', class_='br-seller')
-                if actual_seller_div:
-                    product_data["store"] = actual_seller_div.get_text(strip=True)
-
-            if product_data["store"] == "N/A": 
-                store_tag_merchant = card.find(['a', 'div', 'span'], class_=['br-merchantName', re.compile(r'merchant', re.I)])
-                if store_tag_merchant:
-                    product_data["store"] = store_tag_merchant.get_text(strip=True)
-            
-            if product_data["store"] == "N/A": 
-                store_from_tag = card.find('div', class_='br-pdFrom')
-                if store_from_tag:
-                    store_span = store_from_tag.find('span')
-                    text_to_use = store_span.get_text(strip=True) if store_span else store_from_tag.get_text(strip=True)
-                    if text_to_use.lower().startswith("from "):
-                        product_data["store"] = text_to_use[5:].strip()
-                    else:
-                        product_data["store"] = text_to_use
-            
-            if product_data["link"] and not product_data["link"].startswith(('http://', 'https://')):
-                product_data["link"] = urllib.parse.urljoin(self.base_url, product_data["link"].strip())
-            
-            # Image URL Resolution Logic REMOVED
-            # if product_data["image_url"] and not product_data["image_url"].startswith(('http://', 'https://')):
-            #     product_data["image_url"] = urllib.parse.urljoin(self.base_url, product_data["image_url"].strip())
-
-            if (product_data["title"] != "N/A" and product_data["title"].strip()) or \
-               (product_data["link"] != "N/A" and product_data["link"].strip()):
-                products_on_page.append(product_data)
+            console(Fore.RED + f"[{self.search_term}] Page for search term returned 404. Skipping.",
+                    "not_found", logging.WARNING, term=self.search_term, url=target_url)
+            return False
+        return True
+
+    def _parse_response(self, response, target_url):
+        if not self._validate_response(response, target_url):
+            return []
+        return self.parse_products(response.text, target_url)
 
+    def parse_products(self, html, target_url=None):
+        started = time.perf_counter()
+        products_on_page, cards_found = self.extractor.extract(html, self.base_url)
+        observe("parse_seconds", time.perf_counter() - started)
+        observe("cards_found", cards_found)
+        if not cards_found:
+            console(Fore.YELLOW + f"[{self.search_term}] No product card containers found using common selectors on page ({target_url}).",
+                    "no_cards", logging.WARNING, term=self.search_term, url=target_url)
         return products_on_page
 
+    def _looks_blocked(self, content):
+        return looks_blocked(content)
+
+    def _prepare_retry(self, retry_attempt, wait=True):
+        # Returns False when the retry loop should stop. wait=False when the retry
+        # has already sat out its backoff in a RetryQueue.
+        inc("retries_total")
+        console(Fore.YELLOW + f"[{self.search_term}] Retrying search (Overall attempt {retry_attempt +1})...",
+                "retry", term=self.search_term, attempt=retry_attempt + 1)
+        # A requeued term asked for its new identity when it failed (see
+        # _request_new_identity); an in-place retry changes it here and waits.
+        if self.is_using_tor_fetcher and not self.requeue:
+            if not self._attempt_ip_change_if_tor():
+                console(Fore.RED + f"[{self.search_term}] Failed IP change via Tor, stopping retries.",
+                        "identity_change_failed", logging.WARNING, term=self.search_term)
+                return False
+        # With a shared throttle, backing off is its job (it slows down on blocks).
+        if wait and not self.throttle:
+            time.sleep(7 if self.is_using_tor_fetcher else 3)
+        return True
+
+    def _request_new_identity(self):
+        # For a requeued term: NEWNYM is sent in the background when the attempt
+        # fails, and the retry's backoff gives Tor time to switch, so no worker
+        # waits on it. Pooled circuits are rotated by the pool on poor health, and
+        # the retry is leased the healthiest circuit.
+        if not self.is_using_tor_fetcher or getattr(self.fetcher, 'rotated_by_pool', False):
+            return
+        request_new_identity = getattr(self.fetcher, 'request_new_identity', None)
+        if request_new_identity is not None:
+            request_new_identity()
+
     def scrape(self):
+        started = time.perf_counter()
         all_products_data = []
         page_data = None
+        next_attempt = None
+        last_attempt = self.first_attempt if self.requeue else self.page_retry_attempts
 
-        for retry_attempt in range(self.page_retry_attempts + 1):
-            if retry_attempt > 0:
-                print(Fore.YELLOW + f"[{self.search_term}] Retrying search (Overall attempt {retry_attempt +1})...")
-                if self.is_using_tor_fetcher:
-                    if not self._attempt_ip_change_if_tor():
-                        print(Fore.RED + f"[{self.search_term}] Failed IP change via Tor, stopping retries.")
-                        break
-                time.sleep(7 if self.is_using_tor_fetcher else 3)
+        for retry_attempt in range(self.first_attempt, last_attempt + 1):
+            if retry_attempt > 0 and not self._prepare_retry(retry_attempt, wait=not self.requeue):
+                break
 
+            if retry_attempt > 0:
+                self.partial = True
             page_data = self.extract_product_info_from_page()
             if page_data:
                 all_products_data.extend(page_data)
                 break
 
             last_content = getattr(self.fetcher, 'last_response_content', None)
-            if last_content and isinstance(last_content, str) and \
-               ("captcha" in last_content.lower() or \
-                "access denied" in last_content.lower() or \
-                "blocked" in last_content.lower() or \
-                "unable to process request" in last_content.lower()):
-                print(Fore.YELLOW + f"[{self.search_term}] Possible block/CAPTCHA, retry {retry_attempt+1}/{self.page_retry_attempts}.")
-                if not self.is_using_tor_fetcher:
-                    print(Fore.YELLOW + f"[{self.search_term}] Not using Tor, breaking retries on block/CAPTCHA.")
+            if not self._handle_failed_attempt(last_content, retry_attempt):
+                break
+        else:
+            # Only reached when requeuing: the attempt failed and may be retried later.
+            next_attempt = last_attempt + 1
+            self._request_new_identity()
+
+        if all_products_data and self.max_pages > 1:
+            self._scrape_more_pages(all_products_data)
+        observe("scrape_seconds", time.perf_counter() - started)
+        return self._build_result(all_products_data, next_attempt)
+
+    def _scrape_more_pages(self, all_products_data):
+        offsets = self.page_offsets(all_products_data)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.page_concurrency) as executor:
+            for i in range(0, len(offsets), self.page_concurrency):
+                wave = offsets[i:i + self.page_concurrency]
+                pages = list(executor.map(self.fetch_page, wave))
+                if not self._merge_pages(all_products_data, pages):
                     break
-            elif retry_attempt < self.page_retry_attempts and not page_data:
-                print(Fore.YELLOW + f"[{self.search_term}] No data fetched on attempt {retry_attempt+1}. Retrying...")
 
-            if retry_attempt == self.page_retry_attempts:
-                print(Fore.RED + f"[{self.search_term}] Failed to fetch data after {self.page_retry_attempts +1} attempts.")
+    async def scrape_async(self):
+        # Same retry rules as scrape(), requeue included.
+        started = time.perf_counter()
+        all_products_data = []
+        page_data = None
+        next_attempt = None
+        last_attempt = self.first_attempt if self.requeue else self.page_retry_attempts
+
+        for retry_attempt in range(self.first_attempt, last_attempt + 1):
+            if retry_attempt > 0:
+                inc("retries_total")
+                console(Fore.YELLOW + f"[{self.search_term}] Retrying search (Overall attempt {retry_attempt +1})...",
+                        "retry", term=self.search_term, attempt=retry_attempt + 1)
+                if self.is_using_tor_fetcher and not self.requeue:
+                    if not await self.fetcher.change_tor_identity():
+                        console(Fore.RED + f"[{self.search_term}] Failed IP change via Tor, stopping retries.",
+                                "identity_change_failed", logging.WARNING, term=self.search_term)
+                        break
+                if not self.throttle and not self.requeue:
+                    await asyncio.sleep(7 if self.is_using_tor_fetcher else 3)
+
+            if retry_attempt > 0:
+                self.partial = True
+            page_data = await self.extract_product_info_from_page_async()
+            if page_data:
+                all_products_data.extend(page_data)
+                break
+
+            if not self._handle_failed_attempt(self.last_page_content, retry_attempt):
                 break
+        else:
+            next_attempt = last_attempt + 1
+            self._request_new_identity()
+
+        if all_products_data and self.max_pages > 1:
+            offsets = self.page_offsets(all_products_data)
+            for i in range(0, len(offsets), self.page_concurrency):
+                wave = offsets[i:i + self.page_concurrency]
+                pages = await asyncio.gather(*(self.fetch_page_async(first) for first in wave))
+                if not self._merge_pages(all_products_data, pages):
+                    break
+        observe("scrape_seconds", time.perf_counter() - started)
+        return self._build_result(all_products_data, next_attempt)
+
+    def _handle_failed_attempt(self, last_content, retry_attempt, blocked=None):
+        # Returns False when the retry loop should stop.
+        if blocked is None:
+            blocked = self._looks_blocked(last_content)
+        if blocked:
+            console(Fore.YELLOW + f"[{self.search_term}] Possible block/CAPTCHA, retry {retry_attempt+1}/{self.page_retry_attempts}.",
+                    "blocked", logging.WARNING, term=self.search_term, attempt=retry_attempt + 1)
+            if not self.is_using_tor_fetcher:
+                console(Fore.YELLOW + f"[{self.search_term}] Not using Tor, breaking retries on block/CAPTCHA.",
+                        "retries_stopped", logging.WARNING, term=self.search_term, reason="blocked")
+                return False
+        elif retry_attempt < self.page_retry_attempts:
+            console(Fore.YELLOW + f"[{self.search_term}] No data fetched on attempt {retry_attempt+1}. Retrying...",
+                    "no_data", term=self.search_term, attempt=retry_attempt + 1)
+
+        if retry_attempt == self.page_retry_attempts:
+            console(Fore.RED + f"[{self.search_term}] Failed to fetch data after {self.page_retry_attempts +1} attempts.",
+                    "retries_exhausted", logging.WARNING, term=self.search_term, attempts=self.page_retry_attempts + 1)
+            return False
+        return True
 
+    def _build_result(self, all_products_data, retry_attempt=None):
         start_time_str = time.strftime("%Y%m%d-%H%M%S")
-        filename_prefix = "".join(c if c.isalnum() else "_" for c in self.search_term)
-        filename = f"out/{filename_prefix}_{start_time_str}.json"
 
         result = {
             "search_term_input": self.search_term,
@@ -234,8 +383,15 @@ class BingShopScraper:
             "product_count": len(all_products_data),
             "products": all_products_data
         }
+        if self.market is not None:
+            result["market"] = self.market.code
+        if retry_attempt is not None:
+            result["retry_attempt"] = retry_attempt
+        if self.partial and all_products_data:
+            result["partial"] = True
 
+        inc("terms_total", result="found" if all_products_data else "retrying" if retry_attempt is not None else "empty")
+        inc("products_total", len(all_products_data))
         if all_products_data:
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(result, f, indent=4, ensure_ascii=False)
-        return result
\ No newline at end of file
+            self.output_sink.write(result)
+        return result
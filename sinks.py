@@ -0,0 +1,394 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from colorama import Fore
+from metrics import console
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+pyarrow = None # Imported by the first ParquetSink; it is slow to import.
+
+def _import_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("The 'pyarrow' library is required for Parquet output: pip install pyarrow") from None
+    return pyarrow
+
+def result_filename_prefix(search_term):
+    return "".join(c if c.isalnum() else "_" for c in search_term)
+
+class JsonFileSink:
+    # One pretty-printed JSON file per term per run (the original output format).
+    def __init__(self, out_dir="out"):
+        self.out_dir = out_dir
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+    def location_for(self, result):
+        filename_prefix = result_filename_prefix(result["search_term_input"])
+        if result.get("market"):
+            filename_prefix = f"{result['market']}_{filename_prefix}"
+        return os.path.join(self.out_dir, f"{filename_prefix}_{result['timestamp']}.json")
+
+    def write(self, result):
+        filename = self.location_for(result)
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        return filename
+
+    def after_flush(self, callback):
+        # Files are written synchronously.
+        callback()
+
+    def close(self):
+        pass
+
+class NullSink:
+    # Writes nothing; used by distributed workers, which send results to the coordinator.
+    def location_for(self, result):
+        return "coordinator"
+
+    def write(self, result):
+        return self.location_for(result)
+
+    def after_flush(self, callback):
+        callback()
+
+    def close(self):
+        pass
+
+class NdjsonSink:
+    # Append-only NDJSON: one compact record per line, written by a single
+    # writer thread. Records are flushed (and fsync'ed) in batches, and the
+    # file is rotated once it reaches max_bytes of uncompressed data.
+    # after_flush() lets callers act once their records are on disk.
+    def __init__(self, out_dir="out", prefix="results", compression=None, max_bytes=256 * 1024 * 1024,
+                 flush_every=500, flush_interval=2.0, fsync=True, queue_size=10000):
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unknown NDJSON compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("The 'zstandard' library is required for zstd output: pip install zstandard")
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        self.current_path = None
+        self._raw = None
+        self._stream = None
+        self._bytes_in_file = 0
+        self._file_index = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        # Opened up front so location_for() names the file the first records go to.
+        self._open()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="ndjson-writer", daemon=True)
+        self._writer_thread.start()
+
+    def location_for(self, result):
+        return self.current_path
+
+    def write(self, result):
+        if self._closed:
+            raise RuntimeError("NdjsonSink is closed")
+        self._queue.put(result)
+        return self.location_for(result)
+
+    def after_flush(self, callback):
+        # callback runs on the writer thread once every record written before
+        # this call has been flushed; not at all if that flush fails.
+        if self._closed:
+            raise RuntimeError("NdjsonSink is closed")
+        self._queue.put(_AfterFlush(callback))
+
+    def _next_path(self):
+        suffix = {"gzip": ".gz", "zstd": ".zst"}.get(self.compression, "")
+        name = f"{self.prefix}_{time.strftime('%Y%m%d-%H%M%S')}_{self._file_index:04d}.ndjson{suffix}"
+        return os.path.join(self.out_dir, name)
+
+    def _open(self):
+        self.current_path = self._next_path()
+        self._file_index += 1
+        self._raw = open(self.current_path, "ab")
+        if self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        elif self.compression == "zstd":
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._bytes_in_file = 0
+
+    def _flush(self):
+        if self._stream is None:
+            return
+        self._stream.flush()
+        if self._stream is not self._raw:
+            self._raw.flush()
+        if self.fsync:
+            os.fsync(self._raw.fileno())
+
+    def _close_file(self):
+        if self._stream is None:
+            return
+        self._flush()
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+        self._stream = None
+        self._raw = None
+        if not self._bytes_in_file:
+            os.remove(self.current_path) # Nothing was written to it
+
+    def _writer_loop(self):
+        pending = 0
+        callbacks = [] # after_flush() callbacks waiting for the records before them
+        last_flush = time.monotonic()
+        while True:
+            try:
+                result = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                result = None
+            if result is _STOP:
+                break
+            if isinstance(result, _AfterFlush):
+                callbacks.append(result.callback)
+                result = None
+
+            if result is not None:
+                try:
+                    line = (json.dumps(result, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                    if self._stream is None or self._bytes_in_file >= self.max_bytes:
+                        self._close_file()
+                        self._open()
+                    self._stream.write(line)
+                    self._bytes_in_file += len(line)
+                    pending += 1
+                except Exception as e:
+                    console(Fore.RED + f"NDJSON sink: failed to write record: {e}", "sink_error", logging.ERROR,
+                            sink="ndjson", stage="write", error=str(e))
+
+            if pending and (pending >= self.flush_every or time.monotonic() - last_flush >= self.flush_interval):
+                try:
+                    self._flush()
+                except Exception as e:
+                    console(Fore.RED + f"NDJSON sink: failed to flush {self.current_path}: {e}", "sink_error", logging.ERROR,
+                            sink="ndjson", stage="flush", path=self.current_path, error=str(e))
+                    callbacks = []
+                pending = 0
+                last_flush = time.monotonic()
+            if callbacks and not pending:
+                run_callbacks(callbacks)
+                callbacks = []
+        try:
+            self._close_file()
+        except Exception as e:
+            console(Fore.RED + f"NDJSON sink: failed to close {self.current_path}: {e}", "sink_error", logging.ERROR,
+                    sink="ndjson", stage="close", path=self.current_path, error=str(e))
+            callbacks = []
+        run_callbacks(callbacks)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._writer_thread.join()
+
+_STOP = object()
+
+class _AfterFlush:
+    def __init__(self, callback):
+        self.callback = callback
+
+def run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            console(Fore.RED + f"Output sink: after-flush callback failed: {e}", "sink_error", logging.ERROR,
+                    stage="after_flush", error=str(e))
+
+# One row per product. The normalization and change-detection columns stay
+# null unless those stages are on.
+PARQUET_COLUMNS = (
+    ("search_term", "string"),
+    ("market", "string"),
+    ("timestamp", "timestamp"),
+    ("title", "string"),
+    ("price", "string"),
+    ("link", "string"),
+    ("store", "string"),
+    ("price_value", "float64"),
+    ("price_max", "float64"),
+    ("currency", "string"),
+    ("bing_link", "string"),
+    ("change", "string"),
+    ("old_price", "string"),
+)
+
+def parquet_schema():
+    types = {"string": pyarrow.string(), "float64": pyarrow.float64(), "timestamp": pyarrow.timestamp("s")}
+    return pyarrow.schema([(name, types[kind]) for name, kind in PARQUET_COLUMNS])
+
+def parse_result_timestamp(timestamp):
+    # Results carry time.strftime("%Y%m%d-%H%M%S") local time.
+    try:
+        return datetime.datetime.strptime(timestamp, "%Y%m%d-%H%M%S")
+    except (TypeError, ValueError):
+        return datetime.datetime.now().replace(microsecond=0)
+
+def result_rows(result):
+    # Flattens a result (or a change-detection delta) into product rows.
+    term = result.get("search_term_input")
+    scraped_at = parse_result_timestamp(result.get("timestamp"))
+    if "changes" in result:
+        entries = ((change["product"], change["change"], change.get("old_price")) for change in result["changes"])
+    else:
+        entries = ((product, None, None) for product in result.get("products") or [])
+    for product, change, old_price in entries:
+        yield {
+            "search_term": term,
+            "market": result.get("market"),
+            "timestamp": scraped_at,
+            "title": product.get("title"),
+            "price": product.get("price"),
+            "link": product.get("link"),
+            "store": product.get("store"),
+            "price_value": product.get("price_value"),
+            "price_max": product.get("price_max"),
+            "currency": product.get("currency"),
+            "bing_link": product.get("bing_link"),
+            "change": change,
+            "old_price": old_price,
+        }
+
+class ParquetSink:
+    # Columnar output: product rows are buffered per scrape date and written
+    # as row groups of row_group_size to out_dir/date=YYYY-MM-DD/*.parquet
+    # (Hive-style partitions, readable by pyarrow.dataset, DuckDB, Spark...).
+    # Files are rotated every max_rows_per_file rows. A Parquet file is only
+    # readable once its footer is written, so a crash loses the file that was
+    # open; use ndjson plus export_parquet.py where that matters. For the same
+    # reason after_flush() callbacks only run once the sink is closed.
+    def __init__(self, out_dir="out", prefix="results", row_group_size=100_000, max_rows_per_file=2_000_000,
+                 compression="zstd", queue_size=10000):
+        _import_pyarrow()
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.row_group_size = row_group_size
+        self.max_rows_per_file = max_rows_per_file
+        self.compression = compression
+        self.schema = parquet_schema()
+        self.run_stamp = time.strftime("%Y%m%d-%H%M%S")
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        self.rows_written = 0
+        self._buffers = {} # date -> {column: [values]}
+        self._writers = {} # date -> [ParquetWriter, path, rows in file]
+        self._file_index = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="parquet-writer", daemon=True)
+        self._writer_thread.start()
+
+    def location_for(self, result):
+        date = parse_result_timestamp(result.get("timestamp")).strftime("%Y-%m-%d")
+        return os.path.join(self.out_dir, f"date={date}")
+
+    def write(self, result):
+        if self._closed:
+            raise RuntimeError("ParquetSink is closed")
+        self._queue.put(result)
+        return self.location_for(result)
+
+    def after_flush(self, callback):
+        if self._closed:
+            raise RuntimeError("ParquetSink is closed")
+        self._queue.put(_AfterFlush(callback))
+
+    def _buffer_rows(self, result):
+        for row in result_rows(result):
+            date = row["timestamp"].strftime("%Y-%m-%d")
+            buffer = self._buffers.get(date)
+            if buffer is None:
+                buffer = self._buffers[date] = {name: [] for name, _ in PARQUET_COLUMNS}
+            for name, value in row.items():
+                buffer[name].append(value)
+            if len(buffer["search_term"]) >= self.row_group_size:
+                self._write_row_group(date)
+
+    def _write_row_group(self, date):
+        buffer = self._buffers.pop(date, None)
+        if not buffer or not buffer["search_term"]:
+            return
+        table = pyarrow.Table.from_pydict(buffer, schema=self.schema)
+        writer = self._writers.get(date)
+        if writer is None or writer[2] >= self.max_rows_per_file:
+            if writer is not None:
+                writer[0].close()
+            partition = os.path.join(self.out_dir, f"date={date}")
+            os.makedirs(partition, exist_ok=True)
+            path = os.path.join(partition, f"{self.prefix}_{self.run_stamp}_{self._file_index:04d}.parquet")
+            self._file_index += 1
+            writer = self._writers[date] = [pyarrow.parquet.ParquetWriter(path, self.schema, compression=self.compression), path, 0]
+        writer[0].write_table(table, row_group_size=self.row_group_size)
+        writer[2] += table.num_rows
+        self.rows_written += table.num_rows
+
+    def _writer_loop(self):
+        callbacks = []
+        while True:
+            result = self._queue.get()
+            if result is _STOP:
+                break
+            if isinstance(result, _AfterFlush):
+                callbacks.append(result.callback)
+                continue
+            try:
+                self._buffer_rows(result)
+            except Exception as e:
+                console(Fore.RED + f"Parquet sink: failed to write record: {e}", "sink_error", logging.ERROR,
+                        sink="parquet", stage="write", error=str(e))
+        for date in list(self._buffers):
+            try:
+                self._write_row_group(date)
+            except Exception as e:
+                console(Fore.RED + f"Parquet sink: failed to write final row group for {date}: {e}", "sink_error",
+                        logging.ERROR, sink="parquet", stage="close", date=date, error=str(e))
+        for writer, _, _ in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        run_callbacks(callbacks)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._writer_thread.join()
+
+def build_sink(mode="ndjson", out_dir="out", **options):
+    if mode == "json":
+        return JsonFileSink(out_dir=out_dir)
+    if mode == "ndjson":
+        return NdjsonSink(out_dir=out_dir, **options)
+    if mode == "parquet":
+        return ParquetSink(out_dir=out_dir, **options)
+    raise ValueError(f"Unknown output mode: {mode}")
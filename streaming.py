@@ -0,0 +1,98 @@
+import re
+from metrics import inc
+
+# Response handling shared by every fetcher: FetchResponse and the streamed
+# read with early abort on block pages. Kept free of the parsing and output
+# modules so fetchers (tor.py, tor_pool.py) can import it cheaply.
+
+BLOCK_STATUS_CODES = (403, 429)
+
+class FetchResponse:
+    # Minimal response object for fetchers that are not backed by requests,
+    # and for streamed fetches.
+    def __init__(self, status_code, text=None, url=None, headers=None, content=None):
+        self.status_code = status_code
+        self._text = text
+        self._content = content
+        self.url = url
+        self.headers = headers or {}
+        self.body_size = None
+        self.aborted = False
+
+    @property
+    def text(self):
+        if self._text is None and self._content is not None:
+            self._text = self._content.decode("utf-8", errors="replace")
+        return self._text
+
+    @property
+    def content(self):
+        if self._content is None and self._text is not None:
+            self._content = self._text.encode("utf-8")
+        return self._content
+
+    def __bool__(self):
+        return self.status_code < 400
+
+# Streaming fetches stop downloading once a challenge page is recognised near the
+# top of the body: by its whole <title>, or by a form posting to a captcha or
+# challenge URL. Signature words in free text are not enough, since product
+# titles (and the query, which is echoed in the result page's title) can hold them.
+EARLY_ABORT_RE = re.compile(
+    rb"<title>\s*(?:captcha|verify|access denied|unable to process request|one last step)\s*</title>"
+    rb"|<form[^>]*\baction=[\"'][^\"']*(?:captcha|challenge)", re.I)
+EARLY_ABORT_SCAN_BYTES = 64 * 1024 # Block pages are small; result pages are not scanned past this
+STREAM_CHUNK_SIZE = 16 * 1024
+CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.I)
+
+class BlockScanner:
+    # Incremental matcher fed chunk by chunk. The last few bytes of each chunk are
+    # kept so a signature split across two chunks is still found.
+    def __init__(self, pattern=EARLY_ABORT_RE, scan_limit=EARLY_ABORT_SCAN_BYTES, overlap=256):
+        self.pattern = pattern
+        self.scan_limit = scan_limit
+        self.overlap = overlap
+        self.scanned = 0
+        self._tail = b""
+
+    def feed(self, chunk):
+        if self.scanned >= self.scan_limit:
+            return False
+        window = self._tail + chunk[:self.scan_limit - self.scanned]
+        self.scanned += len(chunk)
+        self._tail = window[-self.overlap:]
+        return self.pattern.search(window) is not None
+
+def response_charset(headers, default="utf-8"):
+    match = CHARSET_RE.search(headers.get("Content-Type", "") if headers else "")
+    return match.group(1) if match else default
+
+def read_streamed_body(chunks, status_code, scan_limit=EARLY_ABORT_SCAN_BYTES):
+    # Reads a streamed body into one buffer. Returns (body, aborted): the read stops
+    # after the first chunk of a block status, or as soon as the scanner recognises
+    # a block page.
+    body = bytearray()
+    scanner = BlockScanner(scan_limit=scan_limit)
+    for chunk in chunks:
+        body += chunk
+        if status_code in BLOCK_STATUS_CODES or scanner.feed(chunk):
+            return body, True
+    return body, False
+
+def decode_body(body, headers):
+    # The decoded text is the only copy kept; FetchResponse re-encodes on demand.
+    try:
+        return body.decode(response_charset(headers), errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+def streamed_fetch_response(response, chunks):
+    # Builds a FetchResponse from a streaming requests/httpx response.
+    body, aborted = read_streamed_body(chunks, response.status_code)
+    result = FetchResponse(response.status_code, decode_body(body, response.headers), url=str(response.url),
+                           headers=response.headers)
+    result.body_size = len(body)
+    result.aborted = aborted
+    if aborted:
+        inc("fetch_aborted_total")
+    return result
@@ -1,10 +1,12 @@
+import logging
+import threading
 import requests
 from stem import Signal
 from stem.control import Controller
 import time
 from colorama import Fore, Style, init
-
-init(autoreset=True)
+from metrics import console, inc, observe, record_fetch
+from streaming import STREAM_CHUNK_SIZE, streamed_fetch_response
 
 DEFAULT_HEADERS_BING_TOR = {
     "Accept": "*/*",
@@ -23,7 +25,7 @@ class TorIPChanger:
     DEFAULT_SOCKS_PORT = 9050
     DEFAULT_CONTROL_PORT = 9051
 
-    def __init__(self, tor_socks_port=DEFAULT_SOCKS_PORT, tor_control_port=DEFAULT_CONTROL_PORT, control_password=None, custom_headers=None, new_ip_wait_time=15):
+    def __init__(self, tor_socks_port=DEFAULT_SOCKS_PORT, tor_control_port=DEFAULT_CONTROL_PORT, control_password=None, custom_headers=None, new_ip_wait_time=15, streaming=True):
         self.proxies = {
             'http': f'socks5h://127.0.0.1:{tor_socks_port}',
             'https': f'socks5h://127.0.0.1:{tor_socks_port}'
@@ -38,8 +40,34 @@ class TorIPChanger:
         self.is_tor_fetcher = True
         self.last_response_content = None
         self.new_ip_wait_time = new_ip_wait_time
+        self.streaming = streaming
 
     def change_tor_identity(self):
+        started = time.perf_counter()
+        changed = self._change_tor_identity()
+        observe("tor_identity_change_seconds", time.perf_counter() - started, fetcher="tor")
+        inc("tor_identity_changes_total", fetcher="tor", result="ok" if changed else "failed")
+        return changed
+
+    def request_new_identity(self):
+        # Sends NEWNYM on a background thread and returns at once, without waiting
+        # for the exit IP to change; for callers that retry later anyway.
+        threading.Thread(target=self._signal_newnym, name="tor-newnym", daemon=True).start()
+
+    def _signal_newnym(self):
+        try:
+            with Controller.from_port(port=self.control_port) as controller:
+                if self.control_password:
+                    controller.authenticate(password=self.control_password)
+                else:
+                    controller.authenticate()
+                controller.signal(Signal.NEWNYM)
+            inc("tor_identity_changes_total", fetcher="tor", result="requested")
+        except Exception as e:
+            inc("tor_identity_changes_total", fetcher="tor", result="failed")
+            console(Fore.RED + f"Error requesting new Tor identity: {e}", "identity_change_error", logging.WARNING, error=str(e))
+
+    def _change_tor_identity(self):
         current_ip_before_change = self.get_current_ip(log_errors=False)
         try:
             with Controller.from_port(port=self.control_port) as controller:
@@ -71,7 +99,7 @@ class TorIPChanger:
                            (final_new_ip and final_new_ip != "IP Not Found")
                 return True
         except Exception as e:
-            print(Fore.RED + f"Error changing Tor identity: {e}")
+            console(Fore.RED + f"Error changing Tor identity: {e}", "identity_change_error", logging.WARNING, error=str(e))
             return False
 
     def get_current_ip(self, log_errors=True):
@@ -92,15 +120,24 @@ class TorIPChanger:
         if custom_headers_for_request:
             current_request_headers.update(custom_headers_for_request)
         
+        started = time.perf_counter()
+        response = None
         try:
+            if self.streaming:
+                with requests.get(url, proxies=self.proxies, timeout=timeout, headers=current_request_headers,
+                                  stream=True) as raw_response:
+                    response = streamed_fetch_response(raw_response, raw_response.iter_content(STREAM_CHUNK_SIZE))
+                self.last_response_content = response.text
+                return response
             response = requests.get(url, proxies=self.proxies, timeout=timeout, headers=current_request_headers)
             self.last_response_content = response.text
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
-            if hasattr(e, 'response') and e.response is not None:
-                 return e.response 
-            return None
+            response = getattr(e, 'response', None)
+            return response
+        finally:
+            record_fetch("tor", started, response)
 
     def post(self, url, data=None, json_payload=None, timeout=25, custom_headers_for_request=None):
         self.last_response_content = None
@@ -118,6 +155,7 @@ class TorIPChanger:
             return None
 
 if __name__ == "__main__":
+    init(autoreset=True)
     print(Fore.MAGENTA + Style.BRIGHT + "Testing TorIPChanger...")
     tor_changer = TorIPChanger(control_password=None) 
 
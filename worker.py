@@ -0,0 +1,162 @@
+import argparse
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+import requests
+from colorama import Fore, Style
+import cli
+import main as scraper
+from sinks import NullSink
+
+# --- Configuration ---
+COORDINATOR_URL = "http://127.0.0.1:8765"
+COORDINATOR_TOKEN = os.environ.get("COORDINATOR_TOKEN") # Must match the coordinator's --token
+LEASE_BATCH_SIZE = 20 # Terms leased per round trip to the coordinator
+IDLE_POLL_INTERVAL = 10 # Seconds to wait before asking again when the queue is empty
+EXIT_WHEN_IDLE = True # Stop once the coordinator has nothing left to hand out
+REQUEST_TIMEOUT = 30
+
+class CoordinatorClient:
+    def __init__(self, base_url, worker_id, token=None, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers["X-Coordinator-Token"] = token
+
+    def _post(self, path, payload):
+        payload = dict(payload, worker=self.worker_id)
+        response = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, limit):
+        return self._post("/lease", {"limit": limit})
+
+    def renew(self, terms):
+        return self._post("/renew", {"terms": terms})
+
+    def submit_results(self, results):
+        return self._post("/results", {"results": results})
+
+    def status(self):
+        response = self.session.get(self.base_url + "/status", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+def renew_leases_until(client, terms, lease_seconds, stop_event):
+    # Renew at a third of the lease so one missed heartbeat doesn't lose the batch.
+    interval = max(1, lease_seconds / 3)
+    while not stop_event.wait(interval):
+        try:
+            client.renew(terms)
+        except requests.RequestException as e:
+            print(Fore.YELLOW + f"Lease renewal failed: {e}")
+
+def process_leased_batch(terms):
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=scraper.MAX_CONCURRENT_WORKERS) as executor:
+        future_to_term = {executor.submit(scraper.process_search_term, term): term for term in terms}
+        for future in concurrent.futures.as_completed(future_to_term):
+            term = future_to_term[future]
+            try:
+                result = future.result()
+                scraper.report_result(term, result)
+                results.append({"term": term, "result": result})
+            except Exception as exc:
+                print(Fore.RED + f"Search term '{term}' generated an exception: {exc}")
+                results.append({"term": term, "error": str(exc)})
+    return results
+
+def submit_with_retry(client, results, attempts=5):
+    for attempt in range(1, attempts + 1):
+        try:
+            return client.submit_results(results)
+        except requests.RequestException as e:
+            print(Fore.YELLOW + f"Failed to send results to coordinator (attempt {attempt}/{attempts}): {e}")
+            time.sleep(min(30, 2 ** attempt))
+    # The leases expire and the coordinator hands these terms out again.
+    print(Fore.RED + f"Giving up on sending {len(results)} results; their terms will be re-leased.")
+    return None
+
+def run_worker(client):
+    batches = 0
+    while True:
+        try:
+            lease = client.lease(LEASE_BATCH_SIZE)
+        except requests.RequestException as e:
+            if getattr(e.response, "status_code", None) == 401:
+                raise SystemExit(Fore.RED + f"Coordinator at {client.base_url} rejected this worker; pass its --token "
+                                 "or set COORDINATOR_TOKEN")
+            print(Fore.RED + f"Could not reach coordinator at {client.base_url}: {e}")
+            time.sleep(IDLE_POLL_INTERVAL)
+            continue
+
+        terms = lease.get("terms") or []
+        if not terms:
+            if EXIT_WHEN_IDLE:
+                print(Fore.BLUE + f"Coordinator has no more terms: {client.status()}")
+                return batches
+            time.sleep(IDLE_POLL_INTERVAL)
+            continue
+
+        batches += 1
+        print(Fore.CYAN + Style.BRIGHT + f"\n--- Leased batch {batches} ({len(terms)} terms) ---")
+        stop_renewing = threading.Event()
+        renewer = threading.Thread(
+            target=renew_leases_until,
+            args=(client, terms, lease.get("lease_seconds", 300), stop_renewing),
+            daemon=True
+        )
+        renewer.start()
+        try:
+            results = process_leased_batch(terms)
+        finally:
+            stop_renewing.set()
+            renewer.join()
+        submit_with_retry(client, results)
+        scraper.print_throttle_metrics()
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape terms leased from a coordinator.")
+    parser.add_argument("--coordinator", default=COORDINATOR_URL)
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{threading.get_native_id()}")
+    parser.add_argument("--token", default=COORDINATOR_TOKEN, help="Coordinator token (default: $COORDINATOR_TOKEN)")
+    # Same scrape settings as `cli.py scrape` (--tor, --workers, --config, --set, ...).
+    cli.add_scrape_options(parser.add_argument_group("scrape settings"))
+    args = parser.parse_args()
+    cli.apply_settings(scraper, cli.collect_settings(args))
+
+    # Results go back to the coordinator, which owns the job store and the output files.
+    scraper.USE_JOB_STORE = False
+    scraper.OUTPUT_SINK = NullSink()
+    if scraper.USE_RESPONSE_CACHE or scraper.CACHE_OFFLINE:
+        scraper.RESPONSE_CACHE = scraper.build_response_cache()
+    if scraper.USE_ADAPTIVE_THROTTLE:
+        scraper.THROTTLE = scraper.build_throttle()
+    if scraper.USE_TOR and scraper.USE_TOR_POOL:
+        scraper.TOR_POOL = scraper.build_tor_pool()
+        print(Fore.BLUE + f"Tor circuit pool: {scraper.TOR_POOL_SIZE} circuits over SOCKS ports {scraper.TOR_SOCKS_PORTS}")
+    if not scraper.USE_TOR:
+        scraper.HTTP_CLIENT = scraper.build_http_client()
+
+    client = CoordinatorClient(args.coordinator, args.worker_id, token=args.token)
+    print(Fore.BLUE + Style.BRIGHT + f"Worker {args.worker_id} using coordinator {args.coordinator}")
+    try:
+        run_worker(client)
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nWorker stopping; unfinished leases will expire and be reassigned.")
+    finally:
+        if scraper.TOR_POOL is not None:
+            scraper.TOR_POOL.close()
+        if scraper.HTTP_CLIENT is not None:
+            scraper.HTTP_CLIENT.close()
+        if scraper.RESPONSE_CACHE is not None:
+            scraper.RESPONSE_CACHE.close()
+    print(Fore.GREEN + Style.BRIGHT + "Worker finished.")
+
+if __name__ == "__main__":
+    main()